@@ -0,0 +1,160 @@
+import numpy as np
+import argparse
+import cProfile
+import io
+import json
+import multiprocessing
+import os
+import pstats
+import resource
+import sys
+import tempfile
+import time
+
+from hmmlearn import HMM
+from hmmdecode import Viterbi
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "hmm-training-data")
+
+# decoder configurations that can be compared; keys are passed straight to Viterbi
+VARIANTS = {
+    "exact": {"engine": "numpy"},
+    "dict": {"engine": "dict"},
+    "tag-dictionary": {"engine": "numpy", "tag_dictionary": True},
+    "tag-dictionary-beam3": {"engine": "numpy", "tag_dictionary": True, "beam": 3},
+    "beam3": {"engine": "numpy", "beam": 3},
+}
+
+# upper bounds (inclusive) of the sentence-length buckets in the latency histogram
+LENGTH_BUCKETS = [10, 20, 40, 80]
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def bucket_name(length):
+    low = 1
+    for high in LENGTH_BUCKETS:
+        if length <= high:
+            return "%d-%d" % (low, high)
+        low = high + 1
+    return "%d+" % low
+
+
+def latency_histogram(lengths, latencies):
+    buckets = {}
+    for length, latency in zip(lengths, latencies):
+        buckets.setdefault(bucket_name(length), []).append(latency * 1000)
+
+    histogram = {}
+    for name in sorted(buckets, key=lambda name: int(name.split("-")[0].rstrip("+"))):
+        values = np.array(buckets[name])
+        histogram[name] = {"sentences": len(values), "mean_ms": float(values.mean()), "p50_ms": float(np.percentile(values, 50)), "p99_ms": float(np.percentile(values, 99))}
+    return histogram
+
+
+def train(corpus, model_file, binary, log_space, suffix_length):
+    start = time.perf_counter()
+    model = HMM()
+    model.count_stream(os.path.join(DATA_DIR, corpus + "_train_tagged.txt"))
+    model.normalize_emission()
+    model.normalize_transition()
+    if suffix_length > 0:
+        model.create_unknown_model(suffix_length)
+    if log_space:
+        model.convert_to_log()
+    train_seconds = time.perf_counter() - start
+
+    if binary:
+        model.write_binary(model_file)
+    else:
+        model.write_json(model_file)
+    return {"train_seconds": train_seconds, "train_peak_rss_mb": peak_rss_mb(), "model_bytes": os.path.getsize(model_file)}
+
+
+def run_variant(corpus, model_file, options, profile):
+    with open(os.path.join(DATA_DIR, corpus + "_dev_raw.txt"), 'r') as f:
+        sentences = [line.split() for line in f.read().splitlines()]
+    with open(os.path.join(DATA_DIR, corpus + "_dev_tagged.txt"), 'r') as f:
+        gold = [line.split() for line in f.read().splitlines()]
+
+    viterbi_model = Viterbi(timing=True, **options)
+    start = time.perf_counter()
+    viterbi_model.read_data(model_file)
+    load_seconds = time.perf_counter() - start
+
+    profiler = cProfile.Profile() if profile else None
+    if profiler is not None:
+        profiler.enable()
+
+    latencies = []
+    tagged = []
+    for sentence in sentences:
+        start = time.perf_counter()
+        tagged.append(viterbi_model.tag_sentence(sentence))
+        latencies.append(time.perf_counter() - start)
+
+    if profiler is not None:
+        profiler.disable()
+
+    tokens = sum(len(sentence) for sentence in sentences)
+    correct = sum(predicted == expected for line, key in zip(tagged, gold) for predicted, expected in zip(line.split(), key))
+    decode_seconds = sum(latencies)
+
+    result = {
+        "load_seconds": load_seconds,
+        "sentences": len(sentences),
+        "tokens": tokens,
+        "decode_seconds": decode_seconds,
+        "sentences_per_second": len(sentences) / decode_seconds,
+        "tokens_per_second": tokens / decode_seconds,
+        "latency_by_length": latency_histogram([len(sentence) for sentence in sentences], latencies),
+        "stage_seconds": viterbi_model.stage_times,
+        "peak_rss_mb": peak_rss_mb(),
+        "accuracy": correct / tokens,
+    }
+
+    if profiler is not None:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(profile)
+        result["profile"] = stream.getvalue()
+    return result
+
+
+def in_fresh_process(function, *args):
+    # a spawned child starts from a clean interpreter, so its peak RSS belongs to this one run
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(function, args)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="benchmark hmmlearn/hmmdecode on the bundled ISDT and GSD data")
+    parser.add_argument("--corpora", nargs="+", default=["it_isdt", "ja_gsd"])
+    parser.add_argument("--variants", nargs="+", default=["exact", "tag-dictionary"], choices=sorted(VARIANTS))
+    parser.add_argument("--binary", action="store_true", help="benchmark the binary model format instead of JSON")
+    parser.add_argument("--no-log", action="store_true", help="use probability instead of log-space parameters")
+    parser.add_argument("--suffix-length", type=int, default=3, help="unknown-word suffix length (0 disables the unknown-word model)")
+    parser.add_argument("--profile", type=int, default=0, metavar="N", help="include the top N cProfile entries of each decode run")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = {"python": sys.version.split()[0], "numpy": np.__version__, "binary": args.binary, "log_space": not args.no_log, "corpora": {}}
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        for corpus in args.corpora:
+            model_file = os.path.join(model_dir, corpus + (".bin" if args.binary else ".txt"))
+            result = in_fresh_process(train, corpus, model_file, args.binary, not args.no_log, args.suffix_length)
+            result["variants"] = {}
+            for variant in args.variants:
+                result["variants"][variant] = in_fresh_process(run_variant, corpus, model_file, VARIANTS[variant], args.profile)
+            report["corpora"][corpus] = result
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
@@ -0,0 +1,117 @@
+import numpy as np
+import argparse
+import json
+
+# Binary model layout:
+#   magic (4 bytes) | header length (uint32) | JSON header | padding | arrays
+# The header holds the tag list, the log_space flag and the dtype/shape/offset of every array.
+# Arrays start on 8-byte boundaries so they can be viewed straight out of a memory map.
+MAGIC = b"HMMB"
+ALIGNMENT = 8
+
+
+def is_binary_model(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def sparse_emission(tags, words, emission, emission_floor=None):
+    if emission_floor is None:
+        # in a dense model the smallest value in a tag's column is its smoothing floor
+        emission_floor = {tag: min((emission[word][tag] for word in words), default=0.0) for tag in tags}
+
+    # only entries above the floor are stored
+    tag_index = {tag: i for i, tag in enumerate(tags)}
+    indptr = [0]
+    emission_tags = []
+    emission_values = []
+    for word in words:
+        for tag, value in emission[word].items():
+            if value > emission_floor[tag]:
+                emission_tags.append(tag_index[tag])
+                emission_values.append(value)
+        indptr.append(len(emission_tags))
+
+    return np.array(indptr, dtype=np.int64), np.array(emission_tags, dtype=np.int32), np.array(emission_values, dtype=np.float64), np.array([emission_floor[tag] for tag in tags], dtype=np.float64)
+
+
+def write_model(filename, tags, words, transition_matrix, emission_indptr, emission_tags, emission_values, emission_floor, log_space=False, unknown=None, trigram_matrix=None):
+    arrays = {
+        "vocabulary": np.frombuffer("\n".join(words).encode('utf-8'), dtype=np.uint8),
+        "transition": np.ascontiguousarray(transition_matrix, dtype=np.float64),
+        "emission_indptr": np.ascontiguousarray(emission_indptr, dtype=np.int64),
+        "emission_tags": np.ascontiguousarray(emission_tags, dtype=np.int32),
+        "emission_values": np.ascontiguousarray(emission_values, dtype=np.float64),
+        "emission_floor": np.ascontiguousarray(emission_floor, dtype=np.float64),
+    }
+    # trigram models add trigram[prev_prev_tag, prev_tag, tag]
+    if trigram_matrix is not None:
+        arrays["trigram"] = np.ascontiguousarray(trigram_matrix, dtype=np.float64)
+
+    # offsets depend on the header size, so lay the arrays out relative to the data section first
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset += -offset % ALIGNMENT
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+
+    # the unknown-word tables are small nested dicts, so they travel in the header
+    header = {"tags": list(tags), "vocabulary_size": len(words), "log_space": log_space, "unknown": unknown, "arrays": layout}
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = len(MAGIC) + 4 + len(header_bytes)
+    padding = -data_start % ALIGNMENT
+    data_start += padding
+
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint32(len(header_bytes) + padding).tobytes())
+        f.write(header_bytes + b" " * padding)
+        for name, array in arrays.items():
+            f.write(b"\0" * (data_start + layout[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+
+
+def read_model(filename):
+    # plain ndarray views over the map: slicing an np.memmap subclass costs several times more per call
+    buffer = np.asarray(np.memmap(filename, dtype=np.uint8, mode='r'))
+    if bytes(buffer[:len(MAGIC)]) != MAGIC:
+        raise ValueError(filename + " is not a binary HMM model")
+
+    header_length = int(buffer[len(MAGIC):len(MAGIC) + 4].view(np.uint32)[0])
+    data_start = len(MAGIC) + 4 + header_length
+    header = json.loads(bytes(buffer[len(MAGIC) + 4:data_start]).decode('utf-8'))
+
+    model = {"tags": header["tags"], "log_space": header["log_space"], "unknown": header.get("unknown")}
+    for name, spec in header["arrays"].items():
+        dtype = np.dtype(spec["dtype"])
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        start = data_start + spec["offset"]
+        model[name] = buffer[start:start + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+
+    vocabulary = bytes(model.pop("vocabulary")).decode('utf-8')
+    model["words"] = vocabulary.split("\n") if header["vocabulary_size"] else []
+    return model
+
+
+def convert(json_filename, binary_filename):
+    with open(json_filename, 'r') as f:
+        json_data = json.load(f)
+
+    tags = json_data["tags"]
+    words = list(json_data["emission"])
+    transition_matrix = np.array([[json_data["transition"][prev_tag][tag] for tag in tags] for prev_tag in tags])
+    emission_indptr, emission_tags, emission_values, emission_floor = sparse_emission(tags, words, json_data["emission"], json_data.get("emission_floor"))
+
+    trigram_matrix = np.array([[[json_data["trigram"][prev_prev_tag][prev_tag][tag] for tag in tags] for prev_tag in tags] for prev_prev_tag in tags]) if "trigram" in json_data else None
+
+    write_model(binary_filename, tags, words, transition_matrix, emission_indptr, emission_tags, emission_values, emission_floor, json_data.get("log_space", False), json_data.get("unknown"), trigram_matrix)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="convert a JSON hmmmodel.txt into the binary model format")
+    parser.add_argument("json_model")
+    parser.add_argument("binary_model")
+    args = parser.parse_args()
+
+    convert(args.json_model, args.binary_model)
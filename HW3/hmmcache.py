@@ -0,0 +1,74 @@
+import collections
+import hashlib
+import json
+import os
+
+
+def file_hash(filename):
+    # the cache is only valid for the exact model bytes it was filled from
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class SentenceCache:
+    def __init__(self, capacity) -> None:
+        # token tuple -> tag list, least recently used first
+        self.capacity = capacity
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+
+    def __len__(self):
+        return len(self.entries)
+
+
+    def get(self, tokens):
+        tags = self.entries.get(tokens)
+        if tags is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(tokens)
+        return tags
+
+
+    def put(self, tokens, tags):
+        self.entries[tokens] = tags
+        self.entries.move_to_end(tokens)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {"capacity": self.capacity, "size": len(self.entries), "hits": self.hits, "misses": self.misses, "evictions": self.evictions, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+    def save(self, filename, key):
+        # key identifies the model bytes and decoder settings the tags were computed with
+        with open(filename + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"key": key, "entries": [[list(tokens), tags] for tokens, tags in self.entries.items()]}, ensure_ascii=False))
+        os.replace(filename + ".tmp", filename)
+
+
+    def load(self, filename, key):
+        # a missing cache, or one written for another model or other settings, is ignored
+        if not os.path.exists(filename):
+            return False
+        with open(filename, 'r') as f:
+            data = json.load(f)
+        if data.get("key") != key:
+            return False
+
+        # oldest entries first, so the most recently used ones survive if the capacity shrank
+        for tokens, tags in data["entries"]:
+            self.put(tuple(tokens), tags)
+        self.evictions = 0
+        return True
@@ -1,27 +1,474 @@
 import numpy as np
+import argparse
+import contextlib
+import heapq
+import itertools
 import json
+import multiprocessing
+import operator
 import sys
+import time
+
+import hmmbinary
+import hmmcache
+import hmmunknown
 
 class Viterbi:
-    def __init__(self) -> None:
+    def __init__(self, engine="numpy", beam=None, tag_dictionary=False, timing=False, trigram=True, cache_size=0) -> None:
+        self.engine = engine
+        # fast mode (numpy engine only): keep the best `beam` states per position and/or
+        # restrict known words to the tags they were seen with in training
+        self.beam = beam
+        self.tag_dictionary = tag_dictionary
+        # trigram models are decoded over (prev_tag, tag) pairs by the numpy engine unless this is turned off
+        self.trigram = trigram
         self.data = None
         self.emission = None
         self.transition = None
         self.tags = None
+        self.log_space = False
+        self.unknown = None
+
+        self.tag_index = None
+        self.all_tags = None
+        self.word_index = None
+        self.transition_matrix = None
+        self.transition_rows = None
+        self.emission_matrix = None
+        self.emission_indptr = None
+        self.emission_tags = None
+        self.emission_values = None
+        self.emission_floor = None
+        self.trigram_matrix = None
+        self.trigram_pruned = None
+        self.trigram_full = None
+        self.trigram_live = None
+        self.live_tags = None
+        self.pair_prev = None
+        self.pair_tag = None
+        self.pair_first = None
+        self.pair_predecessors = None
+        self.pair_transition = None
 
         self.result_matrix = ""
 
+        # repeated sentences are answered from a bounded LRU cache of token tuple -> tags
+        self.cache = hmmcache.SentenceCache(cache_size) if cache_size else None
+
+        # optional per-stage wall-clock totals in seconds (load, decode, format, write)
+        self.stage_times = {} if timing else None
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        if self.stage_times is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_times[name] = self.stage_times.get(name, 0.0) + time.perf_counter() - start
+
 
     def read_data(self, filename):
+        with self.stage("load"):
+            if hmmbinary.is_binary_model(filename):
+                self.read_binary(filename)
+            else:
+                self.read_json(filename)
+
+
+    def read_json(self, filename):
         with open(filename, 'r') as f:
             json_data = json.load(f)
         self.data = json_data
         self.emission = json_data["emission"]
         self.transition = json_data["transition"]
         self.tags = json_data["tags"]
+        # log-space models store log probabilities, so path scores are summed instead of multiplied
+        self.log_space = json_data.get("log_space", False)
+        if json_data.get("unknown"):
+            self.unknown = hmmunknown.UnknownWords(json_data["unknown"], self.tags, self.log_space)
+        self.tag_index = {tag: i for i, tag in enumerate(self.tags)}
+        self.all_tags = list(range(len(self.tags)))
+
+        # sparse models only list observed (word, tag) pairs; older dense models list every pair,
+        # and are only made sparse when the tag dictionary needs the observed pairs
+        if "emission_floor" in json_data or self.tag_dictionary:
+            self.build_sparse_emission(json_data.get("emission_floor"))
+            if self.engine == "dict" and "emission_floor" in json_data:
+                self.expand_emission()
+
+        if self.engine == "numpy":
+            self.build_matrices()
+            if self.trigram and "trigram" in json_data:
+                self.trigram_matrix = np.array([[[json_data["trigram"][prev_prev_tag][prev_tag][tag] for tag in self.tags] for prev_tag in self.tags] for prev_prev_tag in self.tags])
+                self.build_trigram()
+
+
+    def read_binary(self, filename):
+        # arrays stay memory-mapped; only the tag and vocabulary indexes are built in Python
+        model = hmmbinary.read_model(filename)
+        self.tags = model["tags"]
+        self.log_space = model["log_space"]
+        if model["unknown"]:
+            self.unknown = hmmunknown.UnknownWords(model["unknown"], self.tags, self.log_space)
+
+        self.tag_index = {tag: i for i, tag in enumerate(self.tags)}
+        self.all_tags = list(range(len(self.tags)))
+        self.word_index = {word: i for i, word in enumerate(model["words"])}
+
+        self.transition_matrix = model["transition"]
+        self.emission_indptr = model["emission_indptr"]
+        self.emission_tags = model["emission_tags"]
+        self.emission_values = model["emission_values"]
+        self.emission_floor = model["emission_floor"]
+        if self.trigram:
+            self.trigram_matrix = model.get("trigram")
+
+        if self.engine == "numpy" and self.trigram_matrix is not None:
+            self.build_trigram()
+
+        if self.engine == "dict":
+            self.transition = {prev_tag: {tag: float(self.transition_matrix[i, j]) for j, tag in enumerate(self.tags)} for i, prev_tag in enumerate(self.tags)}
+            self.expand_emission()
+
+
+    def build_sparse_emission(self, emission_floor):
+        self.word_index = {word: i for i, word in enumerate(self.emission)}
+        self.emission_indptr, self.emission_tags, self.emission_values, self.emission_floor = hmmbinary.sparse_emission(self.tags, list(self.emission), self.emission, emission_floor)
+
+
+    def expand_emission(self):
+        # the reference decoder works on nested dicts, so expand the sparse table back out
+        self.emission = {}
+        for word, i in self.word_index.items():
+            row = self.emission_row(i)
+            self.emission[word] = {tag: float(row[j]) for j, tag in enumerate(self.tags)}
+
+
+    def emission_row(self, word_index):
+        if self.emission_matrix is not None:
+            return self.emission_matrix[word_index]
+
+        start, end = self.emission_indptr[word_index], self.emission_indptr[word_index + 1]
+        row = self.emission_floor.copy()
+        row[self.emission_tags[start:end]] = self.emission_values[start:end]
+        return row
+
+
+    def word_emission(self, word):
+        # emission scores over all tags, or None when the word is unseen and there is no unknown-word model
+        if word in self.word_index:
+            return self.emission_row(self.word_index[word])
+        if self.unknown is not None:
+            return self.unknown.emission(word)
+        return None
+
+
+    def build_matrices(self):
+        # dense tag-indexed arrays: transition_matrix[prev_tag, tag] and one emission row per word
+        self.transition_matrix = np.array([[self.transition[prev_tag][tag] for tag in self.tags] for prev_tag in self.tags])
+        if self.emission_indptr is not None:
+            return
+
+        self.word_index = {word: i for i, word in enumerate(self.emission)}
+        self.emission_matrix = np.array([[self.emission[word][tag] for tag in self.tags] for word in self.emission]).reshape(len(self.word_index), len(self.tags))
+
+
+    def build_trigram(self):
+        # the learner smooths every transition count by 1e-10, so a tag pair seen in training scores at least
+        # 1/(count of its first tag) while an unseen one stays below 1e-10; 1e-9 separates the two
+        floor = np.log(1e-9) if self.log_space else 1e-9
+        seen = np.asarray(self.transition_matrix) > floor
+        impossible = -np.inf if self.log_space else 0.0
+
+        # laid out [prev_tag, tag, prev_prev_tag] so each step reduces over the contiguous last axis
+        self.trigram_full = np.ascontiguousarray(np.asarray(self.trigram_matrix).transpose(1, 2, 0))
+        self.trigram_pruned = self.trigram_full.copy()
+        self.trigram_pruned[~seen] = impossible
+        self.live_tags = np.array([i for i, tag in enumerate(self.tags) if tag != "<start>"])
+        self.trigram_live = self.trigram_pruned[np.ix_(self.live_tags, self.live_tags, self.live_tags)]
+
+        # without a tag dictionary or beam every position can take every live tag, so the seen pairs are fixed:
+        # pair q is (pair_prev[q], pair_tag[q]), and its predecessors are the seen pairs ending in pair_prev[q],
+        # padded to a common width with an extra always-impossible pair
+        live_seen = seen[np.ix_(self.live_tags, self.live_tags)]
+        prev, tag = np.nonzero(live_seen)
+        self.pair_prev, self.pair_tag = self.live_tags[prev], self.live_tags[tag]
+        start = self.tag_index["<start>"]
+        trigram = np.asarray(self.trigram_matrix)
+        self.pair_first = trigram[start, self.pair_prev, self.pair_tag]
+
+        pairs_ending = [np.flatnonzero(self.pair_tag == b) for b in range(len(self.tags))]
+        width = max(len(p) for p in pairs_ending)
+        self.pair_predecessors = np.full((len(self.pair_prev), width), len(self.pair_prev))
+        self.pair_transition = np.full((len(self.pair_prev), width), impossible)
+        for q, (b, c) in enumerate(zip(self.pair_prev, self.pair_tag)):
+            predecessors = pairs_ending[b]
+            self.pair_predecessors[q, :len(predecessors)] = predecessors
+            self.pair_transition[q, :len(predecessors)] = trigram[self.pair_prev[predecessors], b, c]
 
 
     def viterbi_algorithm(self,sentence):
+        self.result_matrix += self.tag_sentence(sentence)
+
+
+    def tag_sentence(self, sentence):
+        with self.stage("decode"):
+            result = self.cache.get(tuple(sentence)) if self.cache is not None else None
+            if result is None:
+                if self.engine == "numpy" and self.trigram_matrix is not None and not (self.beam or self.tag_dictionary):
+                    result = self.viterbi_trigram_pairs(sentence) or self.viterbi_trigram(sentence, pruned=False)
+                elif self.engine == "numpy" and self.trigram_matrix is not None:
+                    result = self.viterbi_trigram(sentence)
+                elif self.engine == "numpy" and (self.beam or self.tag_dictionary):
+                    result = self.viterbi_pruned(sentence)
+                elif self.engine == "numpy":
+                    result = self.viterbi_numpy(sentence)
+                else:
+                    result = self.viterbi_dict(sentence)
+
+                if self.cache is not None:
+                    self.cache.put(tuple(sentence), result)
+
+        with self.stage("format"):
+            return " ".join(sentence[i] + "/" + result[i] for i in range(len(sentence))) + "\n"
+
+
+    def viterbi_numpy(self, sentence):
+        combine = np.add if self.log_space else np.multiply
+        tag_range = np.arange(len(self.tags))
+        backpointer = np.zeros((len(sentence), len(self.tags)), dtype=np.intp)
+
+        viterbi_vector = self.transition_matrix[self.tag_index["<start>"]]
+        emission = self.word_emission(sentence[0])
+        if emission is not None:
+            viterbi_vector = combine(viterbi_vector, emission)
+
+        # each step scores every (prev_tag, tag) pair at once, then keeps the best prev_tag per tag
+        for word_index in range(1, len(sentence)):
+            prob = combine(viterbi_vector[:, np.newaxis], self.transition_matrix)
+            emission = self.word_emission(sentence[word_index])
+            if emission is not None:
+                prob = combine(prob, emission)
+
+            backpointer[word_index] = np.argmax(prob, axis=0)
+            viterbi_vector = prob[backpointer[word_index], tag_range]
+
+        result = [int(np.argmax(viterbi_vector))]
+        for word_index in range(len(sentence) - 1, 0, -1):
+            result.append(backpointer[word_index][result[-1]])
+
+        result.reverse()
+        return [self.tags[i] for i in result]
+
+
+    def candidate_tags(self, word):
+        # returns the tags a word may take and their emission scores (None when the emission is left out)
+        if word not in self.word_index:
+            if self.unknown is not None:
+                return self.all_tags, self.unknown.emission(word).tolist()
+            return self.all_tags, None
+
+        i = self.word_index[word]
+        if self.tag_dictionary:
+            start, end = self.emission_indptr[i], self.emission_indptr[i + 1]
+            if end > start:
+                return self.emission_tags[start:end].tolist(), self.emission_values[start:end].tolist()
+
+        return self.all_tags, self.emission_row(i).tolist()
+
+
+    def viterbi_pruned(self, sentence):
+        # with only a handful of live states per position, plain Python loops beat per-step numpy call overhead
+        combine = operator.add if self.log_space else operator.mul
+        if self.transition_rows is None:
+            self.transition_rows = np.asarray(self.transition_matrix).tolist()
+
+        # states[i] holds the tag ids kept at position i, backpointer[i] indexes into states[i - 1]
+        states = []
+        backpointer = []
+
+        prev_states = [self.tag_index["<start>"]]
+        viterbi_vector = [0.0 if self.log_space else 1.0]
+
+        for word in sentence:
+            candidates, emission = self.candidate_tags(word)
+            scores = []
+            best_prev = []
+            for j, tag in enumerate(candidates):
+                best_score = combine(viterbi_vector[0], self.transition_rows[prev_states[0]][tag])
+                best = 0
+                for p in range(1, len(prev_states)):
+                    score = combine(viterbi_vector[p], self.transition_rows[prev_states[p]][tag])
+                    if score > best_score:
+                        best_score = score
+                        best = p
+
+                scores.append(best_score if emission is None else combine(best_score, emission[j]))
+                best_prev.append(best)
+
+            if self.beam and len(candidates) > self.beam:
+                keep = sorted(heapq.nlargest(self.beam, range(len(candidates)), key=scores.__getitem__))
+                candidates = [candidates[j] for j in keep]
+                scores = [scores[j] for j in keep]
+                best_prev = [best_prev[j] for j in keep]
+
+            states.append(candidates)
+            backpointer.append(best_prev)
+            prev_states = candidates
+            viterbi_vector = scores
+
+        state = max(range(len(viterbi_vector)), key=viterbi_vector.__getitem__)
+        result = []
+        for word_index in range(len(sentence) - 1, -1, -1):
+            result.append(self.tags[states[word_index][state]])
+            state = backpointer[word_index][state]
+
+        result.reverse()
+        return result
+
+
+    def viterbi_trigram(self, sentence, pruned=True):
+        # second-order Viterbi over (prev_tag, tag) pair states. <start> is never a candidate after the sentence
+        # begins and pairs never seen in training are pruned (see build_trigram); with the tag dictionary each
+        # position also keeps only the tags its word was seen with, and with a beam only the `beam` tags that
+        # end the best pairs. A sentence that no seen pairs can tag is decoded again over every pair
+        combine = np.add if self.log_space else np.multiply
+        start = self.tag_index["<start>"]
+        table = self.trigram_pruned if pruned else self.trigram_full
+
+        # scores[b, a] is the best path ending with tags prev_states[a], states[-1][b]
+        prev_states = np.array([start])
+        candidates, emission = self.trigram_candidates(sentence[0])
+        states = [candidates]
+        scores = table[start, candidates, start][:, np.newaxis]
+        if emission is not None:
+            scores = combine(scores, emission[:, np.newaxis])
+        keep = self.beam_states(scores)
+        if keep is not None:
+            states[0], scores = states[0][keep], scores[keep]
+
+        # backpointer[i][c, b] indexes into states[i - 1] for the pair (states[i][b], states[i + 1][c])
+        backpointer = []
+        for word in sentence[1:]:
+            next_states, emission = self.trigram_candidates(word)
+            if pruned and prev_states is states[-1] is next_states is self.live_tags:
+                # nothing restricted by the dictionary or the beam: the precomputed block of live tags lines up as it is
+                transition = self.trigram_live
+            else:
+                transition = table[np.ix_(states[-1], next_states, prev_states)]
+            prob = combine(scores[:, np.newaxis, :], transition)
+            best = np.argmax(prob, axis=2)
+            scores = np.take_along_axis(prob, best[:, :, np.newaxis], axis=2)[:, :, 0].T
+            best = best.T
+            if emission is not None:
+                scores = combine(scores, emission[:, np.newaxis])
+            keep = self.beam_states(scores)
+            if keep is not None:
+                next_states, scores, best = next_states[keep], scores[keep], best[keep]
+
+            backpointer.append(best)
+            prev_states = states[-1]
+            states.append(next_states)
+
+        if pruned and not self.any_path(scores):
+            # once every pair is pruned no later word can revive a path, so one check per sentence suffices
+            return self.viterbi_trigram(sentence, pruned=False)
+
+        state, prev_state = np.unravel_index(int(np.argmax(scores)), scores.shape)
+        path = [int(state)]
+        if len(sentence) > 1:
+            path.append(int(prev_state))
+            for i in range(len(sentence) - 1, 1, -1):
+                path.append(int(backpointer[i - 1][path[-2], path[-1]]))
+
+        path.reverse()
+        return [self.tags[states[i][j]] for i, j in enumerate(path)]
+
+
+    def viterbi_trigram_pairs(self, sentence):
+        # viterbi_trigram over only the tag pairs seen in training, when no position is restricted; each step
+        # scores every seen pair against its padded predecessors instead of the whole tag cube. Returns None when
+        # every path was pruned, so the caller can decode the sentence over every pair with viterbi_trigram instead
+        combine = np.add if self.log_space else np.multiply
+        impossible = -np.inf if self.log_space else 0.0
+        start = self.tag_index["<start>"]
+
+        # first word: one score per tag, from <start> only over the pairs seen in training
+        first = np.full(len(self.tags), impossible)
+        first[self.live_tags] = self.trigram_pruned[start, self.live_tags, start]
+        emission = self.word_emission(sentence[0])
+        if emission is not None:
+            first = combine(first, emission)
+        if len(sentence) == 1:
+            return [self.tags[int(np.argmax(first))]] if self.any_path(first) else None
+
+        # second word: scores[q] is the best path ending with the pair q, whose only predecessor is (<start>, prev)
+        scores = combine(first[self.pair_prev], self.pair_first)
+        emission = self.word_emission(sentence[1])
+        if emission is not None:
+            scores = combine(scores, emission[self.pair_tag])
+
+        # backpointer[i][q] is the pair at position i + 1 that the best path into pair q at position i + 2 came from
+        backpointer = []
+        rows = np.arange(len(self.pair_prev))
+        for word in sentence[2:]:
+            prob = combine(np.append(scores, impossible)[self.pair_predecessors], self.pair_transition)
+            best = np.argmax(prob, axis=1)
+            scores = prob[rows, best]
+            emission = self.word_emission(word)
+            if emission is not None:
+                scores = combine(scores, emission[self.pair_tag])
+            backpointer.append(self.pair_predecessors[rows, best])
+
+        if not self.any_path(scores):
+            return None
+
+        q = int(np.argmax(scores))
+        path = [self.pair_tag[q]]
+        for pairs in reversed(backpointer):
+            q = pairs[q]
+            path.append(self.pair_tag[q])
+        path.append(self.pair_prev[q])
+
+        path.reverse()
+        return [self.tags[i] for i in path]
+
+
+    def trigram_candidates(self, word):
+        # candidate_tags as arrays, without <start>, which only ever precedes the first word
+        if self.tag_dictionary and word in self.word_index:
+            i = self.word_index[word]
+            start, end = self.emission_indptr[i], self.emission_indptr[i + 1]
+            if end > start:
+                return self.emission_tags[start:end], self.emission_values[start:end]
+
+        emission = self.word_emission(word)
+        return self.live_tags, None if emission is None else emission[self.live_tags]
+
+
+    def any_path(self, scores):
+        return bool(np.any(scores > (-np.inf if self.log_space else 0.0)))
+
+
+    def beam_states(self, scores):
+        # rows (current tags) of the best `beam` pair scores, in tag order; None when nothing is pruned
+        if not self.beam or scores.shape[0] <= self.beam:
+            return None
+        return np.sort(np.argpartition(-scores.max(axis=1), self.beam - 1)[:self.beam])
+
+
+    def viterbi_dict(self, sentence):
+        combine = operator.add if self.log_space else operator.mul
+
+        # unseen words take their scores from the unknown-word model when the model has one
+        emissions = [self.emission.get(word) for word in sentence]
+        if self.unknown is not None:
+            emissions = [emission if emission is not None else dict(zip(self.tags, self.unknown.emission(word).tolist())) for word, emission in zip(sentence, emissions)]
 
         viterbi_matrix = {}
         backpointer = {}
@@ -30,8 +477,8 @@ class Viterbi:
             viterbi_matrix[tag] = {}
             backpointer[tag] = {}
 
-            if sentence[0] in self.emission:
-                viterbi_matrix[tag][0] = self.transition["<start>"][tag] * self.emission[sentence[0]][tag]
+            if emissions[0] is not None:
+                viterbi_matrix[tag][0] = combine(self.transition["<start>"][tag], emissions[0][tag])
             else:
                 viterbi_matrix[tag][0] = self.transition["<start>"][tag]
             
@@ -41,19 +488,20 @@ class Viterbi:
         for word_index in range(1, len(sentence)):
             for tag in self.tags:
     
-                if sentence[word_index] in self.emission:  
-                    prob = [viterbi_matrix[prev_tag][word_index - 1] * self.transition[prev_tag][tag] * self.emission[sentence[word_index]][tag] for prev_tag in self.tags]
+                if emissions[word_index] is not None:
+                    prob = [combine(combine(viterbi_matrix[prev_tag][word_index - 1], self.transition[prev_tag][tag]), emissions[word_index][tag]) for prev_tag in self.tags]
 
                     viterbi_matrix[tag][word_index] = max(prob)
                     backpointer[tag][word_index] = self.tags[np.argmax(prob)]
                 else:
-                    prob = [viterbi_matrix[prev_tag][word_index - 1] * self.transition[prev_tag][tag] for prev_tag in self.tags]
+                    prob = [combine(viterbi_matrix[prev_tag][word_index - 1], self.transition[prev_tag][tag]) for prev_tag in self.tags]
 
                     viterbi_matrix[tag][word_index] = max(prob)
                     backpointer[tag][word_index] = self.tags[np.argmax(prob)]
 
 
-        prob_max = 0.0
+        # start below any score so a fully underflowed column still yields a tag instead of None
+        prob_max = float("-inf")
         tag_max = None
 
         for tag in self.tags:
@@ -69,30 +517,104 @@ class Viterbi:
             result.append(backpointer[result[-1]][word_index])
             
         result.reverse()
-
-        for i in range(len(sentence)):
-            if i!=len(sentence)-1:
-                self.result_matrix += sentence[i] + "/" + result[i] + " "
-            else:
-                self.result_matrix += sentence[i] + "/" + result[i] + "\n"
+        return result
 
     
+    def decode_lines(self, lines):
+        for line in lines:
+            yield self.tag_sentence(line.split())
+
+
+    def decode_file(self, input_file, output_file, buffer_size=1 << 16):
+        # tagged sentences go straight to a buffered writer, so memory stays flat and an interrupted run keeps what was already written
+        with open(input_file, 'r') as f, open(output_file, 'w', encoding='utf-8', buffering=buffer_size) as out:
+            for tagged_sentence in self.decode_lines(f):
+                with self.stage("write"):
+                    out.write(tagged_sentence)
+
+
+    def cache_key(self, model_file):
+        # cached tags depend on the model bytes and on every setting that can change the decoded path
+        return {"model_sha256": hmmcache.file_hash(model_file), "engine": self.engine, "beam": self.beam, "tag_dictionary": self.tag_dictionary, "trigram": self.trigram}
+
+
+    def load_cache(self, cache_file, model_file):
+        return self.cache.load(cache_file, self.cache_key(model_file))
+
+
+    def save_cache(self, cache_file, model_file):
+        self.cache.save(cache_file, self.cache_key(model_file))
+
+
     def write_result(self, filename):
+        # compatibility path for callers that accumulate result_matrix through viterbi_algorithm
         with open(filename, 'w', encoding='utf-8') as f:
             f.write(self.result_matrix)
+
+
+# each pool worker loads the model once; binary models are memory-mapped, so their pages are shared between workers
+worker_model = None
+
+
+def init_worker(model_file, options):
+    global worker_model
+    worker_model = Viterbi(**options)
+    worker_model.read_data(model_file)
+
+
+def tag_lines(lines):
+    return [worker_model.tag_sentence(line.split()) for line in lines]
+
+
+def decode_parallel(model_file, input_file, output_file, processes=None, chunk_size=256, **options):
+    # the input is sharded into chunks of lines; imap hands results back in submission order
+    with open(input_file, 'r') as f, open(output_file, 'w', encoding='utf-8') as out:
+        chunks = iter(lambda: list(itertools.islice(f, chunk_size)), [])
+        with multiprocessing.Pool(processes, init_worker, (model_file, options)) as pool:
+            for tagged_lines in pool.imap(tag_lines, chunks):
+                out.writelines(tagged_lines)
         
 
 if __name__ == "__main__":
-    input_file = sys.argv[1]
-    viterbi_model = Viterbi()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input_file")
+    parser.add_argument("--engine", choices=["numpy", "dict"], default="numpy", help="decoding engine; 'dict' is the original pure-Python decoder")
+    parser.add_argument("--model", default="hmmmodel.txt", help="JSON or binary (hmmbinary.py) model file")
+    parser.add_argument("--beam", type=int, default=None, help="keep only the best BEAM states per position (numpy engine; tags of the pair states for a trigram model)")
+    parser.add_argument("--tag-dictionary", action="store_true", help="restrict known words to the tags they were seen with in training (numpy engine); trigram models always prune tag pairs unseen in training")
+    parser.add_argument("--bigram", action="store_true", help="decode a trigram model with its bigram transitions; the dict engine always does")
+    parser.add_argument("--timing", action="store_true", help="print per-stage timings as JSON to stderr (single process only)")
+    parser.add_argument("--processes", type=int, default=1, help="decode with a pool of this many worker processes (0 uses every core)")
+    parser.add_argument("--chunk-size", type=int, default=256, help="lines handed to a worker at a time in multi-process mode")
+    parser.add_argument("--cache-size", type=int, default=0, help="remember the tags of up to this many distinct sentences (0 disables the cache)")
+    parser.add_argument("--persist-cache", action="store_true", help="load and save the sentence cache next to the model as MODEL.cache (single process only)")
+    args = parser.parse_args()
+    if args.beam is not None and args.beam < 1:
+        parser.error("--beam must keep at least one state")
+    if args.persist_cache and not args.cache_size:
+        parser.error("--persist-cache needs a --cache-size")
+    if args.processes != 1 and (args.persist_cache or args.timing):
+        # each worker has its own cache and timers; neither is collected back into this process
+        parser.error("--persist-cache and --timing only work with --processes 1")
 
-    viterbi_model.read_data("hmmmodel.txt")
+    input_file = args.input_file
+    options = {"engine": args.engine, "beam": args.beam, "tag_dictionary": args.tag_dictionary, "trigram": not args.bigram, "cache_size": args.cache_size}
 
+    if args.processes != 1:
+        decode_parallel(args.model, input_file, "hmmoutput.txt", args.processes or None, args.chunk_size, **options)
+    else:
+        viterbi_model = Viterbi(timing=args.timing, **options)
 
-    with open(input_file, 'r') as f:
-        lines = f.read().splitlines()
+        viterbi_model.read_data(args.model)
+        if args.persist_cache:
+            viterbi_model.load_cache(args.model + ".cache", args.model)
 
-        for line in lines:        
-            viterbi_model.viterbi_algorithm(line.split())
-    
-    viterbi_model.write_result("hmmoutput.txt")
+        viterbi_model.decode_file(input_file, "hmmoutput.txt")
+
+        if args.persist_cache:
+            viterbi_model.save_cache(args.model + ".cache", args.model)
+
+        if args.timing:
+            print(json.dumps(viterbi_model.stage_times), file=sys.stderr)
+        if viterbi_model.cache is not None:
+            print(json.dumps(viterbi_model.cache.stats()), file=sys.stderr)
@@ -1,15 +1,31 @@
 import numpy as np
+import argparse
+import itertools
 import json
-import sys
+import math
+import multiprocessing
+import os
+
+import hmmbinary
+import hmmunknown
 
 class HMM:
     def __init__(self) -> None:
         self.tags = set()
         self.words = set()
         self.tag_count = {}
+        self.emission_count = {}
+        self.transition_count = {}
+        # "prev_prev_tag prev_tag" -> {tag: count}; tags never contain spaces, so the pair key is unambiguous
+        self.trigram_count = {}
+        self.log_space = False
+        self.unknown = None
 
         self.emmission = dict()
+        self.emission_floor = dict()
         self.transition = dict()
+        self.trigram = dict()
+        self.lambdas = None
 
 
 
@@ -19,6 +35,71 @@ class HMM:
         return lines
 
 
+    def count_stream(self, filename):
+        # single pass over the file: each word/TAG token is split once and every count table is updated together
+        with open(filename, 'r') as f:
+            self.count_lines(f)
+
+
+    def count_lines(self, lines):
+        self.tags.add("<start>")
+        for line in lines:
+            prev_prev_tag = prev_tag = "<start>"
+            for token in line.split():
+                word, _, tag = token.rpartition("/")
+                self.words.add(word)
+                self.tags.add(tag)
+                self.tag_count[tag] = self.tag_count.get(tag, 0) + 1
+
+                word_tags = self.emission_count.setdefault(word, {})
+                word_tags[tag] = word_tags.get(tag, 0) + 1
+
+                next_tags = self.transition_count.setdefault(prev_tag, {})
+                next_tags[tag] = next_tags.get(tag, 0) + 1
+
+                next_tags = self.trigram_count.setdefault(prev_prev_tag + " " + prev_tag, {})
+                next_tags[tag] = next_tags.get(tag, 0) + 1
+                prev_prev_tag, prev_tag = prev_tag, tag
+
+
+    def count_parallel(self, filename, processes=None, shard_size=2000):
+        # map: workers count shards of shard_size lines; reduce: their count tables are merged here as they arrive
+        with open(filename, 'r') as f, multiprocessing.Pool(processes) as pool:
+            shards = iter(lambda: list(itertools.islice(f, shard_size)), [])
+            for counts in pool.imap_unordered(count_shard, shards):
+                self.merge_counts(counts)
+
+
+    def counts(self):
+        # the raw count tables are plain JSON-friendly dicts, so shards and earlier runs can be merged later
+        return {"tags": list(self.tags), "tag_count": self.tag_count, "emission_count": self.emission_count, "transition_count": self.transition_count, "trigram_count": self.trigram_count}
+
+
+    def merge_counts(self, counts):
+        # counts add up, so merging shards in any order gives the same tables as one sequential pass
+        self.tags.update(counts["tags"])
+        self.words.update(counts["emission_count"])
+        for tag, count in counts["tag_count"].items():
+            self.tag_count[tag] = self.tag_count.get(tag, 0) + count
+
+        # count tables saved before trigram counting existed simply contribute no trigrams
+        for table, merged in ((counts["emission_count"], self.emission_count), (counts["transition_count"], self.transition_count), (counts.get("trigram_count", {}), self.trigram_count)):
+            for key, tags in table.items():
+                merged_tags = merged.setdefault(key, {})
+                for tag, count in tags.items():
+                    merged_tags[tag] = merged_tags.get(tag, 0) + count
+
+
+    def read_counts(self, filename):
+        with open(filename, 'r') as f:
+            self.merge_counts(json.load(f))
+
+
+    def write_counts(self, filename):
+        with open(filename, 'w', encoding='utf-8') as txt_file:
+            txt_file.write(json.dumps(self.counts(), ensure_ascii=False))
+
+
     def get_tokens(self, data):
         tokens = []
         for line in data:
@@ -44,56 +125,202 @@ class HMM:
 
     def create_emission(self, tokens):
         
-        # for each word in words list create dictionary with tag from tags list as key and their count of occurence as value   
-        emission = {word: {tag: 1e-10 for tag in self.tags} for word in self.words}
+        # for each word keep only the tags it was actually seen with and their count of occurence
+        for token in tokens:
+            word = "/".join(token.split("/")[:-1])
+            tag = token.split("/")[-1]
+            word_tags = self.emission_count.setdefault(word, {})
+            word_tags[tag] = word_tags.get(tag, 0) + 1
+
+        self.normalize_emission()
 
-        for token in tokens:       
-            emission["/".join(token.split("/")[:-1])][token.split("/")[-1]] += 1
- 
-        # each tag in emission dictionary is divided by the number of occurences of that tag in the corpus
+
+    def normalize_emission(self):
+        # each count is smoothed and divided by the number of occurences of that tag in the corpus
+        emission = {}
         for word in self.words:
-            for tag in self.tags:
-                if tag!="<start>":
-                    emission[word][tag] /= (self.tag_count[tag] + 1e-10)
-       
+            emission[word] = {tag: (count + 1e-10) / (self.tag_count[tag] + 1e-10) for tag, count in self.emission_count[word].items()}
+
+        # unseen (word, tag) pairs are not stored; the decoder looks up the tag's smoothing floor instead
+        self.emission_floor = {tag: 1e-10 / (self.tag_count[tag] + 1e-10) for tag in self.tag_count}
+        self.emission_floor["<start>"] = 1e-10
+
         self.emmission = emission
 
     
     def create_transition(self, lines):
 
-        transition = {tag: {tag: 1e-10 for tag in self.tags} for tag in self.tags}
-
         for line in lines:
-            i=0
-            l = line.split()
-            for j in range(len(l)):
-                if i==0:
-                    transition["<start>"][l[j].split("/")[-1]] += 1
-                else:
-                    transition[l[j-1].split("/")[-1]][l[j].split("/")[-1]] += 1              
-                i+=1
-                
-        for tag in transition:
-            total = sum(transition[tag].values())
-            for tag2 in transition[tag]:
-                transition[tag][tag2] /= (total + 1e-10)
+            prev_prev_tag = prev_tag = "<start>"
+            for token in line.split():
+                tag = token.split("/")[-1]
+                next_tags = self.transition_count.setdefault(prev_tag, {})
+                next_tags[tag] = next_tags.get(tag, 0) + 1
+
+                next_tags = self.trigram_count.setdefault(prev_prev_tag + " " + prev_tag, {})
+                next_tags[tag] = next_tags.get(tag, 0) + 1
+                prev_prev_tag, prev_tag = prev_tag, tag
+
+        self.normalize_transition()
+
+
+    def normalize_transition(self):
+        # every tag pair gets 1e-10 smoothing, so the row total includes one smoothing term per tag
+        transition = {}
+        for tag in self.tags:
+            counts = self.transition_count.get(tag, {})
+            total = sum(counts.values()) + len(self.tags) * 1e-10
+            transition[tag] = {tag2: (counts.get(tag2, 0) + 1e-10) / (total + 1e-10) for tag2 in self.tags}
         
         self.transition = transition
 
-    
+
+    def interpolation_weights(self):
+        # deleted interpolation (Brants 2000): every observed trigram votes, with its count, for whichever of the
+        # trigram, bigram and unigram estimates predicts it best once that very occurrence is left out
+        total = sum(self.tag_count.values())
+        lambdas = [0.0, 0.0, 0.0]
+        for pair, counts in self.trigram_count.items():
+            prev_prev_tag, prev_tag = pair.split(" ")
+            pair_total = sum(counts.values())
+            prev_total = sum(self.transition_count[prev_tag].values())
+            for tag, count in counts.items():
+                estimates = [
+                    (self.tag_count[tag] - 1) / (total - 1) if total > 1 else 0.0,
+                    (self.transition_count[prev_tag][tag] - 1) / (prev_total - 1) if prev_total > 1 else 0.0,
+                    (count - 1) / (pair_total - 1) if pair_total > 1 else 0.0,
+                ]
+                lambdas[estimates.index(max(estimates))] += count
+
+        # no trigrams to vote, e.g. an empty corpus or counts written before trigrams were kept: use the bigram model
+        if sum(lambdas) == 0:
+            return [0.0, 1.0, 0.0]
+        return [weight / sum(lambdas) for weight in lambdas]
+
+
+    def normalize_trigram(self):
+        # P(tag | prev_prev_tag, prev_tag) = l3 * trigram + l2 * bigram + l1 * unigram, each smoothed like the transitions
+        self.lambdas = self.interpolation_weights()
+        total = sum(self.tag_count.values())
+        unigram = {tag: (self.tag_count.get(tag, 0) + 1e-10) / (total + len(self.tags) * 1e-10) for tag in self.tags}
+
+        trigram = {}
+        for prev_prev_tag in self.tags:
+            trigram[prev_prev_tag] = {}
+            for prev_tag in self.tags:
+                counts = self.trigram_count.get(prev_prev_tag + " " + prev_tag, {})
+                pair_total = sum(counts.values()) + len(self.tags) * 1e-10
+                trigram[prev_prev_tag][prev_tag] = {tag: self.lambdas[2] * (counts.get(tag, 0) + 1e-10) / (pair_total + 1e-10) + self.lambdas[1] * self.transition[prev_tag][tag] + self.lambdas[0] * unigram[tag] for tag in self.tags}
+
+        self.trigram = trigram
+
+
+    def create_unknown_model(self, suffix_length):
+        # suffix and shape emission tables for words the decoder has never seen
+        self.unknown = hmmunknown.estimate(self.emission_count, suffix_length)
+
+
+    def convert_to_log(self):
+        # smoothing keeps every probability strictly positive, so the log is always defined
+        for word in self.emmission:
+            for tag in self.emmission[word]:
+                self.emmission[word][tag] = math.log(self.emmission[word][tag])
+
+        for tag in self.emission_floor:
+            self.emission_floor[tag] = math.log(self.emission_floor[tag])
+
+        if self.unknown is not None:
+            hmmunknown.convert_to_log(self.unknown)
+
+        for prev_prev_tag in self.trigram:
+            for prev_tag in self.trigram[prev_prev_tag]:
+                for tag in self.trigram[prev_prev_tag][prev_tag]:
+                    self.trigram[prev_prev_tag][prev_tag][tag] = math.log(self.trigram[prev_prev_tag][prev_tag][tag])
+
+        for tag in self.transition:
+            for tag2 in self.transition[tag]:
+                self.transition[tag][tag2] = math.log(self.transition[tag][tag2])
+
+        self.log_space = True
+
+
+    def write_json(self, filename):
+        model = {"emission": self.emmission, "emission_floor": self.emission_floor, "transition": self.transition, "tags": list(self.tags), "log_space": self.log_space, "unknown": self.unknown}
+        if self.trigram:
+            model["trigram"] = self.trigram
+            model["lambdas"] = self.lambdas
+        with open(filename, 'w', encoding='utf-8') as txt_file:
+            txt_file.write(json.dumps(model, ensure_ascii=False))
+
+
+    def write_binary(self, filename):
+        tags = list(self.tags)
+        words = list(self.emmission)
+        transition_matrix = np.array([[self.transition[prev_tag][tag] for tag in tags] for prev_tag in tags])
+        emission_indptr, emission_tags, emission_values, emission_floor = hmmbinary.sparse_emission(tags, words, self.emmission, self.emission_floor)
+        trigram_matrix = np.array([[[self.trigram[prev_prev_tag][prev_tag][tag] for tag in tags] for prev_tag in tags] for prev_prev_tag in tags]) if self.trigram else None
+        hmmbinary.write_model(filename, tags, words, transition_matrix, emission_indptr, emission_tags, emission_values, emission_floor, self.log_space, self.unknown, trigram_matrix)
+
+
+
+def count_shard(lines):
+    shard = HMM()
+    shard.count_lines(lines)
+    return shard.counts()
+
 
 if __name__ == "__main__":
-    input = sys.argv[1]
+    parser = argparse.ArgumentParser()
+    parser.add_argument("input")
+    parser.add_argument("--log", action="store_true", help="write log probabilities so the decoder sums scores instead of multiplying")
+    parser.add_argument("--binary", action="store_true", help="write the memory-mappable hmmmodel.bin instead of hmmmodel.txt")
+    parser.add_argument("--suffix-length", type=int, default=3, help="longest word suffix used by the unknown-word model (0 disables it)")
+    parser.add_argument("--stream", action="store_true", help="count the corpus in a single streaming pass instead of loading it into memory")
+    parser.add_argument("--processes", type=int, default=1, help="count shards of the corpus in this many worker processes (0 uses every core)")
+    parser.add_argument("--shard-size", type=int, default=2000, help="lines per shard with --processes")
+    parser.add_argument("--counts", help="count table to start from if it exists; the merged counts are written back to it")
+    parser.add_argument("--trigram", action="store_true", help="also write trigram transitions interpolated with the bigram and unigram estimates")
+    args = parser.parse_args()
+
+    input = args.input
     model = HMM()
-    lines = model.read_data(input)
 
-    tokens = model.get_tokens(lines)
+    # earlier counts are added to, so new data only has to be counted once
+    if args.counts and os.path.exists(args.counts):
+        model.read_counts(args.counts)
+
+    if args.processes != 1:
+        model.count_parallel(input, args.processes or None, args.shard_size)
+        model.normalize_emission()
+        model.normalize_transition()
+    elif args.stream:
+        model.count_stream(input)
+        model.normalize_emission()
+        model.normalize_transition()
+    else:
+        lines = model.read_data(input)
+
+        tokens = model.get_tokens(lines)
+
+        model.get_tags(tokens)
+        model.get_words(tokens)
+        model.create_emission(tokens)
+
+        model.create_transition(lines)
+
+    if args.counts:
+        model.write_counts(args.counts)
+
+    if args.trigram:
+        model.normalize_trigram()
 
-    model.get_tags(tokens)
-    model.get_words(tokens)
-    model.create_emission(tokens)
+    if args.suffix_length > 0:
+        model.create_unknown_model(args.suffix_length)
 
-    model.create_transition(lines)
+    if args.log:
+        model.convert_to_log()
 
-    with open('hmmmodel.txt', 'w', encoding='utf-8') as txt_file:
-        txt_file.write(json.dumps({"emission": model.emmission, "transition": model.transition, "tags": list(model.tags)}, ensure_ascii=False))
+    if args.binary:
+        model.write_binary('hmmmodel.bin')
+    else:
+        model.write_json('hmmmodel.txt')
@@ -0,0 +1,93 @@
+import numpy as np
+import math
+
+
+def word_shape(word):
+    # coarse orthographic class of a word, shared by the learner and the decoder
+    if not any(c.isalnum() for c in word):
+        return "punct"
+    if any(c.isdigit() for c in word):
+        return "number" if all(c.isdigit() or not c.isalnum() for c in word) else "has-digit"
+    if word.isupper():
+        return "upper"
+    if word[0].isupper():
+        return "capitalized"
+    if "-" in word:
+        return "hyphen"
+    if word.islower():
+        return "lower"
+    return "uncased"
+
+
+def word_suffixes(word, suffix_length):
+    # longest first, so the decoder can back off to shorter suffixes
+    return [word[-i:] for i in range(min(suffix_length, len(word)), 0, -1)]
+
+
+def estimate(emission_count, suffix_length=3, max_word_count=10):
+    # rare words behave most like unseen ones, so only words seen at most max_word_count times are used
+    suffix_count = {}
+    shape_count = {}
+    tag_count = {}
+    for word, tags in emission_count.items():
+        if sum(tags.values()) > max_word_count:
+            continue
+
+        keys = [("suffix", suffix) for suffix in word_suffixes(word, suffix_length)] + [("shape", word_shape(word))]
+        for tag, count in tags.items():
+            tag_count[tag] = tag_count.get(tag, 0) + count
+            for table, key in keys:
+                counts = (suffix_count if table == "suffix" else shape_count).setdefault(key, {})
+                counts[tag] = counts.get(tag, 0) + count
+
+    # P(key | tag) among rare words; pairs that never occur fall back to the floor in the decoder
+    suffix = {key: {tag: count / tag_count[tag] for tag, count in counts.items()} for key, counts in suffix_count.items()}
+    shape = {key: {tag: count / tag_count[tag] for tag, count in counts.items()} for key, counts in shape_count.items()}
+    return {"suffix_length": suffix_length, "floor": 1e-10, "suffix": suffix, "shape": shape}
+
+
+def convert_to_log(unknown):
+    for table in ("suffix", "shape"):
+        for key in unknown[table]:
+            for tag in unknown[table][key]:
+                unknown[table][key][tag] = math.log(unknown[table][key][tag])
+    unknown["floor"] = math.log(unknown["floor"])
+
+
+class UnknownWords:
+    def __init__(self, unknown, tags, log_space=False, cache_size=100000) -> None:
+        self.suffix_length = unknown["suffix_length"]
+        self.floor = unknown["floor"]
+        self.suffix = unknown["suffix"]
+        self.shape = unknown["shape"]
+        self.tag_index = {tag: i for i, tag in enumerate(tags)}
+        self.num_tags = len(tags)
+        self.combine = np.add if log_space else np.multiply
+
+        # one emission vector per distinct unseen word, so repeated OOV tokens cost a single dict lookup
+        self.cache = {}
+        self.cache_size = cache_size
+
+
+    def table_row(self, table, key):
+        row = np.full(self.num_tags, self.floor)
+        for tag, value in table[key].items():
+            row[self.tag_index[tag]] = value
+        return row
+
+
+    def emission(self, word):
+        if word in self.cache:
+            return self.cache[word]
+
+        shape = word_shape(word)
+        row = self.table_row(self.shape, shape) if shape in self.shape else np.full(self.num_tags, self.floor)
+        for suffix in word_suffixes(word, self.suffix_length):
+            if suffix in self.suffix:
+                row = self.combine(row, self.table_row(self.suffix, suffix))
+                break
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[word] = row
+        return row
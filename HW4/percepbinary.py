@@ -0,0 +1,247 @@
+import numpy as np
+import argparse
+import bisect
+import json
+import mmap
+import sys
+
+import perceptokens
+
+# Binary model layout (same scheme as HW3/hmmbinary.py):
+#   magic (4 bytes) | header length (uint32) | JSON header | padding | arrays
+# The header holds labels, stopwords, n-gram order, bias, quantization scales and the dtype/shape/offset of
+# every array. Arrays start on 8-byte boundaries and are read straight out of a memory map.
+MAGIC = b"PCPB"
+ALIGNMENT = 8
+INT16_MAX = 32767
+
+
+def is_binary_model(filename):
+    with open(filename, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class Vocabulary:
+    def __init__(self, buffer, start, offsets, cache_size=100000) -> None:
+        # words are sorted by their UTF-8 bytes, so a lookup is a binary search over the mapped file
+        self.buffer = buffer
+        self.start = start
+        self.offsets = offsets.tolist()
+        self.size = len(self.offsets) - 1
+
+        # rows of words looked up so far (-1 for misses); only words that actually occur are ever decoded
+        self.cache = {}
+        self.cache_size = cache_size
+
+
+    def word(self, i):
+        return self.buffer[self.start + self.offsets[i]:self.start + self.offsets[i + 1]]
+
+
+    def row(self, word):
+        if word in self.cache:
+            return self.cache[word]
+
+        key = word.encode('utf-8')
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self.word(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        row = low if low < self.size and self.word(low) == key else -1
+
+        if len(self.cache) >= self.cache_size:
+            self.cache.clear()
+        self.cache[word] = row
+        return row
+
+
+    def __contains__(self, word):
+        return self.row(word) >= 0
+
+
+    def __getitem__(self, word):
+        row = self.row(word)
+        if row < 0:
+            raise KeyError(word)
+        return row
+
+
+class HashedVocabulary:
+    def __init__(self, buckets, hash_bits) -> None:
+        # sorted ids of the hash buckets that kept a weight row
+        self.buckets = buckets.tolist()
+        self.hash_bits = hash_bits
+
+
+    def row(self, word):
+        bucket = perceptokens.feature_hash(word, self.hash_bits)
+        row = bisect.bisect_left(self.buckets, bucket)
+        return row if row < len(self.buckets) and self.buckets[row] == bucket else -1
+
+
+    def __contains__(self, word):
+        return self.row(word) >= 0
+
+
+    def __getitem__(self, word):
+        row = self.row(word)
+        if row < 0:
+            raise KeyError(word)
+        return row
+
+
+def compact(words, weights, hash_bits=0, threshold=0.0):
+    """
+    Drop rows whose weights are all within threshold of zero and sort the rest by word (or by hash bucket)
+    """
+    keep = np.flatnonzero(np.abs(weights).max(axis=1) > threshold) if len(weights) else np.zeros(0, dtype=np.int64)
+    if hash_bits:
+        # a hashed model's rows are its buckets, already in sorted order
+        return keep, weights[keep]
+
+    keep = sorted(keep.tolist(), key=lambda i: words[i].encode('utf-8'))
+    return [words[i] for i in keep], weights[keep]
+
+
+def quantize(weights, dtype):
+    """
+    Pack weights as float32, or as int16 with one scale per label head
+    """
+    if dtype == "float32":
+        return weights.astype(np.float32), None
+
+    largest = np.abs(weights).max(axis=0) if len(weights) else np.zeros(weights.shape[1])
+    scale = largest / INT16_MAX
+    # integer heads that already fit, like vanilla perceptron weights, are stored exactly
+    scale[(largest <= INT16_MAX) & np.all(weights == np.rint(weights), axis=0)] = 1.0
+    scale[scale == 0] = 1.0
+    return np.clip(np.rint(weights / scale), -INT16_MAX, INT16_MAX).astype(np.int16), scale
+
+
+def write_model(filename, words, weights, bias, labels, stopwords, ngram=1, hash_bits=0, dtype="int16", threshold=0.0):
+    keys, rows = compact(words, np.asarray(weights, dtype=np.float64), hash_bits, threshold)
+    packed, scale = quantize(rows, dtype)
+
+    if hash_bits:
+        arrays = {"buckets": np.asarray(keys, dtype=np.uint32)}
+    else:
+        encoded = [word.encode('utf-8') for word in keys]
+        arrays = {
+            "vocabulary": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "vocabulary_offsets": np.cumsum([0] + [len(word) for word in encoded], dtype=np.int64),
+        }
+    arrays["weights"] = np.ascontiguousarray(packed)
+
+    layout = {}
+    offset = 0
+    for name, array in arrays.items():
+        offset += -offset % ALIGNMENT
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += array.nbytes
+
+    header = {"labels": [list(label) for label in labels], "stopwords": sorted(stopwords), "ngram": ngram, "hash_bits": hash_bits, "bias": [float(b) for b in bias], "scale": None if scale is None else scale.tolist(), "arrays": layout}
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+    data_start = len(MAGIC) + 4 + len(header_bytes)
+    padding = -data_start % ALIGNMENT
+    data_start += padding
+
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint32(len(header_bytes) + padding).tobytes())
+        f.write(header_bytes + b" " * padding)
+        for name, array in arrays.items():
+            f.write(b"\0" * (data_start + layout[name]["offset"] - f.tell()))
+            f.write(array.tobytes())
+
+
+def read_model(filename):
+    # the map stays open for the life of the arrays; nothing but the header is parsed up front
+    with open(filename, 'rb') as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(filename + " is not a binary perceptron model")
+
+    header_length = int(np.frombuffer(buffer, dtype=np.uint32, count=1, offset=len(MAGIC))[0])
+    data_start = len(MAGIC) + 4 + header_length
+    header = json.loads(buffer[len(MAGIC) + 4:data_start].decode('utf-8'))
+
+    arrays = {}
+    for name, spec in header["arrays"].items():
+        count = int(np.prod(spec["shape"], dtype=np.int64))
+        arrays[name] = np.frombuffer(buffer, dtype=np.dtype(spec["dtype"]), count=count, offset=data_start + spec["offset"]).reshape(spec["shape"])
+
+    if header["hash_bits"]:
+        vocabulary = HashedVocabulary(arrays["buckets"], header["hash_bits"])
+    else:
+        vocabulary = Vocabulary(buffer, data_start + header["arrays"]["vocabulary"]["offset"], arrays["vocabulary_offsets"])
+
+    return {
+        "labels": header["labels"],
+        "stopwords": header["stopwords"],
+        "ngram": header["ngram"],
+        "bias": np.array(header["bias"], dtype=np.float64),
+        "scale": None if header["scale"] is None else np.array(header["scale"], dtype=np.float64),
+        "vocabulary": vocabulary,
+        "weights": arrays["weights"],
+    }
+
+
+def export(json_filename, binary_filename, dtype="int16", threshold=0.0):
+    from percepclassify import PerceptronClassify
+
+    model = PerceptronClassify(json_filename)
+    # the JSON vocabulary is a word -> count dict in weight-row order
+    words = list(model.words) if not model.hash_bits else None
+    write_model(binary_filename, words, model.weights, model.bias, model.labels, model.stopwords, model.ngram, model.hash_bits, dtype, threshold)
+
+
+def check(json_filename, binary_filename, text_file, key_file=None, tolerance=0.005):
+    """
+    Classify text_file with both models; the compact one passes if its dev accuracy (or, without a key,
+    its agreement with the original predictions) is within tolerance on every label head
+    """
+    from percepclassify import PerceptronClassify
+
+    original = PerceptronClassify(json_filename, text_file)
+    compact = PerceptronClassify(binary_filename, text_file)
+    original.classify()
+    compact.classify()
+
+    heads = len(original.labels)
+    agreement = [sum(a[k] == b[k] for a, b in zip(original.predictions, compact.predictions)) / len(original.ids) for k in range(heads)]
+    report = {"agreement": agreement}
+    passed = all(1 - value <= tolerance for value in agreement)
+
+    if key_file is not None:
+        with open(key_file, 'r') as f:
+            keys = {row.split(" ")[0]: row.split(" ")[1:] for row in f.read().splitlines()}
+        report["original_accuracy"] = [sum(p[k] == keys[i][k] for i, p in zip(original.ids, original.predictions)) / len(original.ids) for k in range(heads)]
+        report["compact_accuracy"] = [sum(p[k] == keys[i][k] for i, p in zip(compact.ids, compact.predictions)) / len(compact.ids) for k in range(heads)]
+        passed = all(a - b <= tolerance for a, b in zip(report["original_accuracy"], report["compact_accuracy"]))
+
+    report["tolerance"] = tolerance
+    report["passed"] = passed
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="export a perceptron model as a compact memory-mappable binary file")
+    parser.add_argument("json_model", help="vanillamodel.txt or averagedmodel.txt")
+    parser.add_argument("binary_model")
+    parser.add_argument("--dtype", choices=["int16", "float32"], default="int16", help="int16 stores one scale per label head")
+    parser.add_argument("--threshold", type=float, default=0.0, help="drop words whose weights are all within this of zero")
+    parser.add_argument("--check", metavar="TEXT", help="compare predictions of both models on this file, e.g. dev-text.txt")
+    parser.add_argument("--key", help="labels for --check, e.g. dev-key.txt; accuracy is compared instead of agreement")
+    parser.add_argument("--tolerance", type=float, default=0.005, help="largest accuracy drop (or disagreement) per head that --check accepts")
+    args = parser.parse_args()
+
+    export(args.json_model, args.binary_model, args.dtype, args.threshold)
+
+    if args.check:
+        report = check(args.json_model, args.binary_model, args.check, args.key, args.tolerance)
+        print(json.dumps(report, indent=2))
+        if not report["passed"]:
+            sys.exit(1)
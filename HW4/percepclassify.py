@@ -1,39 +1,86 @@
+import numpy as np
 import json
-import re
+import os
 import sys
 
+import percepbinary
+import perceptokens
+
 
 class PerceptronClassify:
-    def __init__(self, model_file, test_file):
+    def __init__(self, model_file, test_file=None):
         self.ids = []
         self.reviews = []
 
-        self.test_words = dict()
-        self.predict_true_fake = []
-        self.predict_pos_neg = []
+        self.predictions = []
 
         self.read_model(model_file)
-        self.read_test(test_file)
+        if test_file is not None:
+            self.read_test(test_file)
 
 
     def read_model(self, filename):
         """
         Read the model file and initialize the weights and bias
         """
+        # int16-quantized weights carry one scale per label head; JSON models are used as they are
+        self.weight_scale = None
+        if percepbinary.is_binary_model(filename):
+            self.read_binary(filename)
+            return
+
         with open(filename, 'r') as f:
             json_data = json.load(f)
         self.data = json_data
-        self.vanilla_weights1 = json_data["weights1"]
-        self.vanilla_weights2 = json_data["weights2"]
-        self.vanilla_bias1 = json_data["bias1"]
-        self.vanilla_bias2 = json_data["bias2"]
-        self.stopwords = json_data["stopwords"]
-        self.words = json_data["words"]
+        self.stopwords = frozenset(json_data["stopwords"])
+
+        # one (positive, negative) label pair per head; older models only carry the two original heads
+        self.labels = json_data.get("labels", [["True", "Fake"], ["Pos", "Neg"]])
+
+        self.ngram = json_data.get("ngram", 1)
+
+        # a hashed model has no vocabulary: words map to rows through perceptokens.feature_hash
+        self.hash_bits = json_data.get("hash_bits", 0)
+        if self.hash_bits:
+            self.words = []
+            self.word_index = None
+            self.weights = np.array([json_data["weights%d" % (k + 1)] for k in range(len(self.labels))], dtype=np.float64).T.reshape(1 << self.hash_bits, len(self.labels))
+        elif "feature_index" in json_data:
+            # the vocabulary lives in a separate file shared by every model trained with it, relative to the model
+            with open(os.path.join(os.path.dirname(filename), json_data["feature_index"]), 'r') as f:
+                self.words = json.load(f)["features"]
+            self.word_index = {word: i for i, word in enumerate(self.words)}
+            self.weights = np.array([json_data["weights%d" % (k + 1)] for k in range(len(self.labels))], dtype=np.float64).T.reshape(len(self.words), len(self.labels))
+        else:
+            self.words = json_data["words"]
+            self.word_index = {word: i for i, word in enumerate(self.words)}
+            # |V| x K weight matrix, one column per label head
+            self.weights = np.array([[json_data["weights%d" % (k + 1)].get(word, 0) for k in range(len(self.labels))] for word in self.words], dtype=np.float64).reshape(len(self.words), len(self.labels))
+        self.bias = np.array([json_data["bias%d" % (k + 1)] for k in range(len(self.labels))], dtype=np.float64)
+
+
+    def read_binary(self, filename):
+        """
+        Map a compact model written by percepbinary.py; words are looked up in the file only as reviews need them
+        """
+        model = percepbinary.read_model(filename)
+        self.data = None
+        self.stopwords = frozenset(model["stopwords"])
+        self.labels = model["labels"]
+        self.ngram = model["ngram"]
+
+        # hashed and plain models both resolve words to rows through the vocabulary object
+        self.hash_bits = 0
+        self.words = None
+        self.word_index = model["vocabulary"]
+        self.weights = model["weights"]
+        self.weight_scale = model["scale"]
+        self.bias = model["bias"]
 
 
     def read_test(self,filename):
         """
-        Read the test file and store the ids and reviews
+        Read the test file and store the ids and raw reviews; tokenization happens when a block is scored
         """
         with open(filename, 'r') as f:
             lines = f.read().splitlines()
@@ -41,86 +88,55 @@ class PerceptronClassify:
         for row in lines:
             row_data = row.split(" ")
             self.ids.append(row_data[0])
-            self.reviews.append(" ".join(row_data[i].lower() for i in range(1,len(row_data))))
+            self.reviews.append(" ".join(row_data[1:]))
 
-        self.remove_punctuation()
-        self.remove_stopwords()
-        
-        self.word_count()
-    
 
-    def remove_stopwords(self):
+    def classify(self, batch_size=4096):
         """
-        Remove the stopwords from the reviews
+        Classify every review under every label head, e.g. True/Fake and Pos/Neg, one block of reviews at a time
         """
-        for i in range(len(self.reviews)):
-            self.reviews[i] = " ".join([w for w in self.reviews[i].split() if w not in self.stopwords])
+        for start in range(0, len(self.reviews), batch_size):
+            self.predictions.extend(self.classify_batch(self.reviews[start:start + batch_size]))
 
-    
-    def remove_punctuation(self):
+
+    def document_term_matrix(self, reviews):
         """
-        Remove the punctuation from the reviews using regular expressions
+        Tokenize a block of raw reviews into a sparse (review, word, count) matrix over the model vocabulary
         """
-        # remove punctuation using regex
-        for i in range(len(self.reviews)):
-            self.reviews[i] = re.sub(r'[^\w\s]','',self.reviews[i])
+        rows = []
+        columns = []
+        counts = []
+        for row, review in enumerate(reviews):
+            review_counts = dict()
+            ids = perceptokens.hashed_ids(review, self.hash_bits, self.stopwords, self.ngram) if self.hash_bits else perceptokens.token_ids(review, self.word_index, self.stopwords, self.ngram)
+            for index in ids:
+                review_counts[index] = review_counts.get(index, 0) + 1
 
+            rows.extend([row] * len(review_counts))
+            columns.extend(review_counts)
+            counts.extend(review_counts.values())
 
-    def word_count(self):
-        """
-        Count the number of words in the reviews
-        """
-        for review in self.reviews:
-            for word in review.split():
-                if word=='': continue
-                if word in self.words and word not in self.stopwords:
-                    if word not in self.test_words:
-                        self.test_words[word] = 1
-                    else:
-                        self.test_words[word] += 1
+        return np.array(rows, dtype=np.int64), np.array(columns, dtype=np.int64), np.array(counts, dtype=np.float64)
 
 
-    def classify(self):
+    def score(self, reviews):
         """
-        Classify the reviews as positive or negative and true or fake
+        Score a block of reviews with one sparse matrix-vector product per label head, without touching the model
         """
-        for review in self.reviews:
-            test_words = dict()
-            for word in review.split():
-                if word=='': continue
-                if word in self.words and word not in self.stopwords:
-                    if word not in test_words:
-                        test_words[word] = 1
-                    else:
-                        test_words[word] += 1
-                
-
-            activation1 = 0
-            activation2 = 0
+        rows, columns, counts = self.document_term_matrix(reviews)
+        scores = np.empty((len(reviews), len(self.labels)))
+        for k in range(len(self.labels)):
+            # bincount sums each review's weighted counts in token order, like the per-review loop did
+            weights = self.weights[columns, k] if self.weight_scale is None else self.weights[columns, k] * self.weight_scale[k]
+            scores[:, k] = np.bincount(rows, weights=counts * weights, minlength=len(reviews)) + self.bias[k]
+        return scores
 
-            for word in test_words:
-                if word not in self.vanilla_weights1:
-                    self.vanilla_weights1[word] = 0
-                if word not in self.vanilla_weights2:
-                    self.vanilla_weights2[word] = 0
 
-                #only update the weights that are in the training data and ignore otherwise
-                if word in self.words:
-                    activation1 += self.vanilla_weights1[word] * test_words[word]
-                    activation2 += self.vanilla_weights2[word] * test_words[word]
-                    
-            activation1 += self.vanilla_bias1
-            activation2 += self.vanilla_bias2
-
-            if activation1 > 0:
-                self.predict_true_fake.append("True")
-            else:
-                self.predict_true_fake.append("Fake")
-            
-            if activation2 > 0:
-                self.predict_pos_neg.append("Pos")
-            else:
-                self.predict_pos_neg.append("Neg")
+    def classify_batch(self, reviews):
+        """
+        Return one label per head for each review in the block
+        """
+        return [[positive if score > 0 else negative for score, (positive, negative) in zip(review_scores, self.labels)] for review_scores in self.score(reviews).tolist()]
 
 
     def write_predictions(self, filename):
@@ -129,7 +145,7 @@ class PerceptronClassify:
         """
         with open(filename, 'w') as f:
             for i in range(len(self.ids)):
-                f.write(self.ids[i] + " " + self.predict_true_fake[i] + " " + self.predict_pos_neg[i] + "\n")
+                f.write(self.ids[i] + " " + " ".join(self.predictions[i]) + "\n")
 
 
 
@@ -1,22 +1,40 @@
-import sys
-import re
+import numpy as np
+import argparse
 import json
+import os
+import sys
+
+import perceptokens
+
+# one classification head per label column in the data: (positive label, negative label)
+LABELS = [("True", "Fake"), ("Pos", "Neg")]
+
 
 class Preprocess_Data:
-    def __init__(self):
+    def __init__(self, hash_bits=0, ngram=1, min_count=1):
         self.ids = list()
-        self.true_fake = list()
-        self.pos_neg = list()
+        self.labels = None
+        # token lists, one per review; tokenized once in read_data and reused by word_count and featurize
         self.reviews = list()
-        self.stopwords = list()
+        self.stopwords = perceptokens.STOPWORDS
+
+        # CSR matrix of word counts: row i covers indices[indptr[i]:indptr[i+1]] and the matching counts
+        self.indptr = None
+        self.indices = None
+        self.counts = None
+        self.rows = list()
 
+        # features are words plus, with ngram > 1, runs of up to ngram words; rarer ones than min_count are dropped
+        self.ngram = ngram
+        self.min_count = min_count
         self.words = dict()
-        self.weights1 = dict()
-        self.weights2 = dict()
-        self.average_weights1 = dict()
-        self.average_weights2 = dict()
-        self.bias1 = 0
-        self.bias2 = 0
+        self.word_index = dict()
+        # with hash_bits, words share 2^hash_bits weight rows by feature_hash instead of getting one row each
+        self.hash_bits = hash_bits
+        # |V| x K weight matrices, one column per label head
+        self.weights = None
+        self.average_weights = None
+        self.bias = np.zeros(len(LABELS), dtype=np.int64)
 
     
     def read_data(self,filename):
@@ -26,285 +44,546 @@ class Preprocess_Data:
         with open(filename, 'r') as f:
             lines = f.read().splitlines()
 
+        labels = []
         for row in lines:
             row_data = row.split(" ")
             self.ids.append(row_data[0])
-            self.true_fake.append(1 if row_data[1]=="True" else -1)
-            self.pos_neg.append(1 if row_data[2]=="Pos" else -1)
-            self.reviews.append(" ".join(row_data[i].lower() for i in range(3,len(row_data))))
-   
-        self.remove_punctuation()
-        self.remove_stopwords()
+            labels.append([1 if row_data[1 + k]==positive else -1 for k, (positive, _) in enumerate(LABELS)])
+            self.reviews.append(list(perceptokens.tokens(" ".join(row_data[1 + len(LABELS):]), self.stopwords)))
+
+        self.labels = np.array(labels, dtype=np.int64).reshape(len(self.ids), len(LABELS))
 
         self.word_count()
+        self.featurize()
     
     
-    def remove_stopwords(self):
+    def word_count(self):
         """
-        Remove the stopwords from the reviews
+        Count the number of times a word appears in the reviews, index the vocabulary and initialize the weights
+        A hashed run keeps no vocabulary at all, so its memory does not grow with the number of distinct words
         """
-        self.stopwords = ["i", "me", "my", "myself", "we", "our", "ours", "ourselves", "you", "your", "yours", "yourself", "he", "him", "his", "himself", "she", "her", "hers", "herself", "it", "its", "itself", "they", "them", "their", "theirs", "themselves", "what", "which", "who", "whom", "this", "that", "these", "those", "am", "is", "are", "was", "were", "be", "been", "being", "have", "has", "had", "having", "do", "does", "did", "doing", "a", "an", "the", "and", "but", "if", "or", "because", "as", "until", "while", "of", "at", "by", "for", "with", "about", "against", "between", "into", "through", "during", "before", "after", "above", "below", "to", "from", "up", "down", "in", "out", "on", "off", "over", "under", "again", "further", "then", "once", "here", "there", "when", "where", "so", "than", "too", "very", "can", "will", "just", "should", "now"]
-        self.stop_words = set(self.stopwords)
-        for i in range(len(self.reviews)):
-            self.reviews[i] = " ".join([word for word in self.reviews[i].split() if word not in self.stop_words])
-    
+        if self.hash_bits:
+            self.weights = np.zeros((1 << self.hash_bits, len(LABELS)), dtype=np.int64)
+            self.average_weights = np.zeros((1 << self.hash_bits, len(LABELS)), dtype=np.int64)
+            return
 
-    def remove_punctuation(self):
+        for review in self.reviews:
+            for word in perceptokens.ngrams(review, self.ngram):
+                if word not in self.words:
+                    self.words[word] = 1
+                    # indices follow first sight; a seeded vocabulary keeps its own and only new words are appended
+                    if self.min_count <= 1:
+                        self.word_index[word] = len(self.word_index)
+                else:
+                    self.words[word] += 1
+
+        if self.min_count > 1:
+            # rare words are only known once everything is counted, so the survivors are indexed afterwards
+            self.words = {word: count for word, count in self.words.items() if count >= self.min_count}
+            for word in self.words:
+                if word not in self.word_index:
+                    self.word_index[word] = len(self.word_index)
+
+        self.weights = np.zeros((len(self.words), len(LABELS)), dtype=np.int64)
+        self.average_weights = np.zeros((len(self.words), len(LABELS)), dtype=np.int64)
+
+
+    def seed_vocabulary(self, words, counts):
         """
-        Remove the punctuation from the reviews using regex
+        Start from an earlier run's vocabulary so its features keep their indices when new data is read
         """
-        # remove punctuation using regex
-        for i in range(len(self.reviews)):
-            self.reviews[i] = re.sub(r'[^\w\s]','',self.reviews[i])
+        self.words = dict(zip(words, counts))
+        self.word_index = {word: i for i, word in enumerate(words)}
 
 
-    def word_count(self):
+    def featurize(self):
         """
-        Count the number of times a word appears in the reviews and initialize the weights
+        Turn every review's token list into a CSR matrix of word counts over the vocabulary index
         """
+        indptr = [0]
+        indices = []
+        counts = []
         for review in self.reviews:
-            for word in review.split():
-                if word not in self.words:
-                    self.words[word] = 1
-                    self.weights1[word] = 0
-                    self.weights2[word] = 0
-                    self.average_weights1[word] = 0
-                    self.average_weights2[word] = 0
-                else:
-                    self.words[word] += 1
+            # keyed by index, so words that hash to the same bucket are counted together
+            review_counts = dict()
+            for index in self.review_ids(review):
+                review_counts[index] = review_counts.get(index, 0) + 1
+
+            indices.extend(review_counts)
+            counts.extend(review_counts.values())
+            indptr.append(len(indices))
+
+        self.indptr = np.array(indptr, dtype=np.int64)
+        self.indices = np.array(indices, dtype=np.int64)
+        self.counts = np.array(counts, dtype=np.int64)
+        self.rows = [(self.indices[start:end], self.counts[start:end]) for start, end in zip(indptr[:-1], indptr[1:])]
+
+
+    def review_ids(self, review):
+        """
+        Feature indices of a review's token list: hash buckets, or rows of the known vocabulary
+        """
+        features = perceptokens.ngrams(review, self.ngram)
+        if self.hash_bits:
+            return (perceptokens.feature_hash(feature, self.hash_bits) for feature in features)
+        return (self.word_index[feature] for feature in features if feature in self.word_index)
+
+
+    def hold_out(self, fraction, seed=None):
+        """
+        Move a random fraction of the training reviews out of the training rows and return them for early stopping
+        """
+        order = np.random.default_rng(seed).permutation(len(self.rows))
+        cut = int(round(len(self.rows) * fraction))
+        heldout, train = np.sort(order[:cut]), np.sort(order[cut:])
+
+        heldout_rows = ([self.rows[i] for i in heldout], self.labels[heldout])
+        self.rows = [self.rows[i] for i in train]
+        self.labels = self.labels[train]
+        self.ids = [self.ids[i] for i in train]
+        self.reviews = [self.reviews[i] for i in train]
+        return heldout_rows
+
+
+    def token_ids(self, text):
+        """
+        Feature indices of a raw review, exactly as percepclassify computes them for this model
+        """
+        if self.hash_bits:
+            return perceptokens.hashed_ids(text, self.hash_bits, self.stopwords, self.ngram)
+        return perceptokens.token_ids(text, self.word_index, self.stopwords, self.ngram)
+
+
+    def read_dev(self, text_file, key_file):
+        """
+        Featurize held-out reviews over the training vocabulary and read their labels from the key file
+        """
+        keys = dict()
+        with open(key_file, 'r') as f:
+            for row in f.read().splitlines():
+                row_data = row.split(" ")
+                keys[row_data[0]] = [1 if row_data[1 + k]==positive else -1 for k, (positive, _) in enumerate(LABELS)]
+
+        rows = []
+        labels = []
+        with open(text_file, 'r') as f:
+            for row in f.read().splitlines():
+                review_id, _, text = row.partition(" ")
+                review_counts = dict()
+                for index in self.token_ids(text):
+                    review_counts[index] = review_counts.get(index, 0) + 1
+                rows.append((np.array(list(review_counts), dtype=np.int64), np.array(list(review_counts.values()), dtype=np.int64)))
+                labels.append(keys[review_id])
+
+        return rows, np.array(labels, dtype=np.int64).reshape(len(rows), len(LABELS))
+
+
+    def write_feature_index(self, filename):
+        """
+        Write the feature index once so several model files can refer to it instead of repeating the vocabulary
+        """
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({"ngram": self.ngram, "min_count": self.min_count, "features": list(self.words), "counts": list(self.words.values())}, ensure_ascii=False))
+
+
+    def to_model(self, weights, bias, feature_index=None):
+        """
+        Build the model file contents, one word -> weight dictionary and bias per label head
+        A hashed model stores one weight list per head over the 2^hash_bits buckets and no vocabulary
+        With a feature_index file, the weight lists follow that file's feature order instead
+        """
+        if self.hash_bits:
+            model = {"hash_bits": self.hash_bits}
+            for k in range(len(LABELS)):
+                model["weights%d" % (k + 1)] = weights[:, k].tolist()
+        elif feature_index is not None:
+            model = {"feature_index": feature_index}
+            for k in range(len(LABELS)):
+                model["weights%d" % (k + 1)] = weights[:, k].tolist()
+        else:
+            model = {"words": self.words}
+            for k in range(len(LABELS)):
+                model["weights%d" % (k + 1)] = dict(zip(self.words, weights[:, k].tolist()))
+        for k in range(len(LABELS)):
+            model["bias%d" % (k + 1)] = bias[k].item()
+        model["stopwords"] = sorted(self.stopwords)
+        model["labels"] = LABELS
+        model["ngram"] = self.ngram
+        return model
+
+
+def accuracy(rows, labels, weights, bias):
+    """
+    Accuracy of each label head on featurized (features, counts) rows
+    """
+    correct = np.zeros(len(LABELS))
+    for (features, counts), label in zip(rows, labels):
+        activation = counts @ weights.take(features, axis=0) + bias
+        correct += np.where(activation > 0, 1, -1) == label
+    return (correct / len(rows)).tolist()
+
+
+def load_state(filename, hash_bits=0, min_count=1):
+    """
+    Read a training state or checkpoint written by save_checkpoint and make sure it fits a run with these settings
+    """
+    with np.load(filename) as f:
+        state = {name: f[name] for name in f.files}
+
+    # states saved before these were recorded came from plain runs
+    saved = (int(state.get("hash_bits", 0)), int(state.get("min_count", 1)))
+    if saved != (hash_bits, min_count):
+        raise ValueError("%s was saved with hash_bits=%d min_count=%d, this run uses hash_bits=%d min_count=%d" % ((filename,) + saved + (hash_bits, min_count)))
+    # the weight rows must be the vocabulary rows, or copying them back would scramble the model
+    if len(state["weights"]) != len(state["words"]):
+        raise ValueError("%s has %d weight rows for %d words" % (filename, len(state["weights"]), len(state["words"])))
+    return state
+
+
+def save_checkpoint(filename, **arrays):
+    """
+    Write training state as an .npz archive, replacing any earlier checkpoint only once it is complete
+    """
+    with open(filename + ".tmp", 'wb') as f:
+        np.savez(f, **arrays)
+    os.replace(filename + ".tmp", filename)
 
 
 ### Vanilla Perceptron Algorithm
 class VanillaPerceptron:
     def __init__(self,data):
         self.epochs = 10
+        # stop after an epoch without mistakes, or after `patience` epochs without a held-out improvement
+        self.stop_on_convergence = False
+        self.patience = 0
 
-        self.vanilla_weights1 = data.weights1
-        self.vanilla_weights2 = data.weights2
-        self.vanilla_bias1 = data.bias1
-        self.vanilla_bias2 = data.bias2
+        self.vanilla_weights = data.weights
+        self.vanilla_bias = data.bias.copy()
+        # the same features featurize() gives a token list: n-grams included, hashed or looked up in the vocabulary
+        self.review_ids = data.review_ids
 
 
-    def train(self, data):
+    def state(self, data):
         """
-        Train the model on the training data and update the weights
+        Everything needed to continue training later: the vocabulary with its counts, the weights and the bias
         """
-        for _ in range(self.epochs):
-            for row in range(len(data.reviews)):
-                review = data.reviews[row]
-                true_fake = data.true_fake[row]
-                pos_neg = data.pos_neg[row]
+        return {"words": np.array(list(data.words)), "counts": np.array(list(data.words.values()), dtype=np.int64), "ngram": data.ngram, "hash_bits": data.hash_bits, "min_count": data.min_count, "weights": self.vanilla_weights, "bias": self.vanilla_bias}
 
-                words = dict()
-                for word in review.split():
-                    if word=="": continue
-                    if word not in words:
-                        words[word] = 1
-                    else:
-                        words[word] += 1
 
-                self.update_weights(words, true_fake, pos_neg)
+    def load_state(self, state):
+        """
+        Continue from a saved state; rows of words added since then start at zero
+        """
+        self.vanilla_weights[:len(state["weights"])] = state["weights"]
+        self.vanilla_bias[:] = state["bias"]
 
 
-    def update_weights(self, review, true_fake, pos_neg):
+    def train(self, data, dev=None, checkpoint_every=0, checkpoint_file=None, seed=None, heldout=None, state_file=None):
         """
-        Update activation values and bias for each word in the review
+        Train the model on the featurized training data and update the weights
+        Optionally report dev accuracy after every epoch and checkpoint every checkpoint_every examples
+        With a seed, every epoch visits the reviews in a fresh random order instead of file order
+        With patience, training stops early on the heldout rows and keeps the best epoch's weights
+        With a state_file, the final state is saved for a later warm start
         """
-        self.vanilla_activation1 = 0
-        self.vanilla_activation2 = 0
+        rng = np.random.default_rng(seed)
+        seen = 0
+        best = None
+        stale = 0
+        for epoch in range(self.epochs):
+            mistakes = 0
+            for row in (range(len(data.rows)) if seed is None else rng.permutation(len(data.rows))):
+                features, counts = data.rows[row]
+                mistakes += self.update_weights(features, counts, data.labels[row])
+
+                seen += 1
+                if checkpoint_every and seen % checkpoint_every == 0:
+                    save_checkpoint(checkpoint_file, examples=seen, **self.state(data))
+
+            if dev is not None:
+                print("vanilla epoch %d dev accuracy %s" % (epoch + 1, " ".join("%.4f" % a for a in accuracy(*dev, self.vanilla_weights, self.vanilla_bias))), file=sys.stderr)
+
+            if self.patience:
+                score = np.mean(accuracy(*heldout, self.vanilla_weights, self.vanilla_bias))
+                if best is None or score > best[0]:
+                    best = (score, self.vanilla_weights.copy(), self.vanilla_bias.copy())
+                    stale = 0
+                else:
+                    stale += 1
 
-        for word in review:
-            self.vanilla_activation1 += self.vanilla_weights1[word] * review[word]
-        self.vanilla_activation1 += self.vanilla_bias1
+            if self.stop_on_convergence and mistakes == 0:
+                print("vanilla converged after epoch %d" % (epoch + 1), file=sys.stderr)
+                break
+            if self.patience and stale >= self.patience:
+                print("vanilla stopped after epoch %d, no held-out improvement in %d epochs" % (epoch + 1, stale), file=sys.stderr)
+                break
 
-        if true_fake * self.vanilla_activation1 <= 0:
-            for word in review:
-                self.vanilla_weights1[word] += true_fake * review[word]
-            
-            self.vanilla_bias1 += true_fake
+        if best is not None:
+            # in place, since the averaged perceptron continues from these same arrays
+            self.vanilla_weights[:] = best[1]
+            self.vanilla_bias[:] = best[2]
 
+        if state_file is not None:
+            save_checkpoint(state_file, **self.state(data))
 
-        for word in review:
-            self.vanilla_activation2 += self.vanilla_weights2[word] * review[word]
-        self.vanilla_activation2 += self.vanilla_bias2
-        
-        if pos_neg * self.vanilla_activation2 <= 0:
-            for word in review:
-                self.vanilla_weights2[word] += pos_neg * review[word]
-            
-            self.vanilla_bias2 += pos_neg     
+
+    def update_weights(self, features, counts, labels):
+        """
+        Score every label head with one sparse dot product and update the heads that were wrong
+        """
+        # take() gathers the review's rows noticeably faster than fancy indexing
+        self.vanilla_activation = counts @ self.vanilla_weights.take(features, axis=0) + self.vanilla_bias
+
+        wrong = labels * self.vanilla_activation <= 0
+        mistakes = np.count_nonzero(wrong)
+        if mistakes:
+            update = labels * wrong
+            self.vanilla_weights[features] += counts[:, np.newaxis] * update
+            self.vanilla_bias += update
+        return mistakes
 
 
     def predict(self, review):
         """
-        Predict the class of the review
+        Predict the activation of every label head for a review's token list
         """
-        prediction = 0
-        for word in review.split():
-            if word in self.vanilla_weights1:
-                prediction += self.vanilla_weights1[word]
-        prediction += self.vanilla_bias1
+        prediction = self.vanilla_bias.copy()
+        for index in self.review_ids(review):
+            prediction = prediction + self.vanilla_weights[index]
         return prediction
 
 
     def test(self, data):
         """
-        Test the model on the test data
+        Test the model on the test data and return the accuracy of each label head
         """
-        correct = 0
+        correct = np.zeros(len(LABELS))
         for i in range(len(data.reviews)):
-            review = data.reviews[i]
-            true_fake = data.true_fake[i]
-            
-            prediction = self.predict(review)
-            if prediction > 0 and true_fake == 1:
-                correct += 1
-            elif prediction < 0 and true_fake == -1:
-                correct += 1
-        return correct / len(data.reviews)
+            prediction = self.predict(data.reviews[i])
+            correct += (prediction > 0) & (data.labels[i] == 1) | (prediction < 0) & (data.labels[i] == -1)
+        return (correct / len(data.reviews)).tolist()
 
 
 ### Averaged Perceptron Algorithm
 class AveragePerceptron:
     def __init__(self,data):
-        self.weights = dict()
         self.epochs = 80
+        # stop after an epoch without mistakes, or after `patience` epochs without a held-out improvement
+        self.stop_on_convergence = False
+        self.patience = 0
 
-        self.average_weights1 = data.average_weights1
-        self.average_weights2 = data.average_weights2
-        self.average_bias1 = data.bias1
-        self.average_bias2 = data.bias2
-        self.weights1 = data.weights1
-        self.weights2 = data.weights2
+        self.average_weights = data.average_weights
+        self.average_bias = data.bias.copy()
+        self.weights = data.weights
+        # the same features featurize() gives a token list: n-grams included, hashed or looked up in the vocabulary
+        self.review_ids = data.review_ids
 
         self.count = 1
-        self.beta1 = 0
-        self.beta2 = 0
+        self.beta = np.zeros(len(LABELS), dtype=np.int64)
     
 
-    def train(self, data):
+    def state(self, data):
         """
-        Train the model on the training data and update the weights
+        Everything needed to continue training later; the raw accumulators, not the averages, so updates can resume exactly
         """
-        for _ in range(self.epochs):
-            for row in range(len(data.reviews)):
-                review = data.reviews[row]
-                true_fake = data.true_fake[row]
-                pos_neg = data.pos_neg[row]
+        return {"words": np.array(list(data.words)), "counts": np.array(list(data.words.values()), dtype=np.int64), "ngram": data.ngram, "hash_bits": data.hash_bits, "min_count": data.min_count, "weights": self.weights, "average_weights": self.average_weights, "average_bias": self.average_bias, "beta": self.beta, "count": self.count}
 
-                words = dict()
-                for word in review.split():
-                    if word=="": continue
-                    if word not in words:
-                        words[word] = 1
-                    else:
-                        words[word] += 1
 
-                self.update_weights(words, true_fake, pos_neg)
-        
-        self.update_average_weights_bias()
+    def load_state(self, state):
+        """
+        Continue from a saved state; rows of words added since then start at zero
+        """
+        # the saved run's own weights replace the vanilla weights this perceptron would otherwise start from
+        self.weights = np.zeros_like(self.weights)
+        self.weights[:len(state["weights"])] = state["weights"]
+        self.average_weights[:len(state["average_weights"])] = state["average_weights"]
+        self.average_bias = state["average_bias"].copy()
+        self.beta = state["beta"].copy()
+        self.count = int(state["count"])
 
 
-    def update_weights(self, review, true_fake, pos_neg):
+    def train(self, data, dev=None, checkpoint_every=0, checkpoint_file=None, seed=None, heldout=None, state_file=None):
         """
-        Update activation values and bias for each word in the review
-        Update average weights and beta values
+        Train the model on the featurized training data and update the weights
+        Optionally report dev accuracy of the running average after every epoch and checkpoint every checkpoint_every examples
+        With a seed, every epoch visits the reviews in a fresh random order instead of file order
+        With patience, training stops early on the heldout rows and keeps the best epoch's averages
+        With a state_file, the final accumulators are saved for a later warm start
         """
-        self.activation1 = 0
-        self.activation2 = 0
+        rng = np.random.default_rng(seed)
+        best = None
+        stale = 0
+        for epoch in range(self.epochs):
+            mistakes = 0
+            for row in (range(len(data.rows)) if seed is None else rng.permutation(len(data.rows))):
+                features, counts = data.rows[row]
+                mistakes += self.update_weights(features, counts, data.labels[row])
+
+                if checkpoint_every and (self.count - 1) % checkpoint_every == 0:
+                    save_checkpoint(checkpoint_file, **self.state(data))
+
+            if dev is not None:
+                print("averaged epoch %d dev accuracy %s" % (epoch + 1, " ".join("%.4f" % a for a in accuracy(*dev, *self.averaged()))), file=sys.stderr)
+
+            if self.patience:
+                score = np.mean(accuracy(*heldout, *self.averaged()))
+                if best is None or score > best[0]:
+                    best = (score, self.weights.copy(), self.average_weights.copy(), self.average_bias.copy(), self.beta.copy(), self.count)
+                    stale = 0
+                else:
+                    stale += 1
 
-        for word in review:
-            self.activation1 += self.weights1[word] * review[word]
-        self.activation1 += self.average_bias1
+            if self.stop_on_convergence and mistakes == 0:
+                print("averaged converged after epoch %d" % (epoch + 1), file=sys.stderr)
+                break
+            if self.patience and stale >= self.patience:
+                print("averaged stopped after epoch %d, no held-out improvement in %d epochs" % (epoch + 1, stale), file=sys.stderr)
+                break
 
-        if true_fake * self.activation1 <= 0:
-            for word in review:
-                self.weights1[word] += true_fake * review[word]
-                self.average_weights1[word] += self.count * true_fake * review[word]
-            
-            self.average_bias1 += true_fake
-            self.beta1 += self.count * true_fake
+        if best is not None:
+            self.weights[:] = best[1]
+            self.average_weights[:] = best[2]
+            self.average_bias, self.beta, self.count = best[3], best[4], best[5]
 
+        if state_file is not None:
+            save_checkpoint(state_file, **self.state(data))
 
+        self.update_average_weights_bias()
 
-        for word in review:
-            self.activation2 += self.weights2[word] * review[word]
-        self.activation2 += self.average_bias2
-        
-        if pos_neg * self.activation2 <= 0:
-            for word in review:
-                self.weights2[word] += pos_neg * review[word]
-                self.average_weights2[word] += self.count * pos_neg * review[word]
-            
-            self.average_bias2 += pos_neg
-            self.beta2 += self.count * pos_neg
+
+    def update_weights(self, features, counts, labels):
+        """
+        Score every label head with one sparse dot product and update the heads that were wrong
+        Update average weights and beta values
+        """
+        # take() gathers the review's rows noticeably faster than fancy indexing
+        self.activation = counts @ self.weights.take(features, axis=0) + self.average_bias
+
+        wrong = labels * self.activation <= 0
+        mistakes = np.count_nonzero(wrong)
+        if mistakes:
+            update = labels * wrong
+            delta = counts[:, np.newaxis] * update
+            self.weights[features] += delta
+            self.average_weights[features] += self.count * delta
+            self.average_bias += update
+            self.beta += self.count * update
         
         self.count += 1
+        return mistakes
 
 
-    def update_average_weights_bias(self):
+    def averaged(self, features=slice(None)):
         """
-        Update average weights and bias for each word
+        Materialize the averaged weights of the given feature rows (all by default) and the averaged bias
         """
-        for word in self.weights1:
-            self.average_weights1[word] = self.weights1[word] - (self.average_weights1[word] / float(self.count))
-        
-        self.average_bias1 = self.average_bias1 - (self.beta1 / self.count)
+        # average_weights accumulates count * delta at update time, so w - u/c is the running average of
+        # any row in O(1) without touching features that are not asked for
+        return self.weights[features] - (self.average_weights[features] / float(self.count)), self.average_bias - (self.beta / self.count)
 
 
-        for word in self.weights2:
-            self.average_weights2[word] = self.weights2[word] - (self.average_weights2[word] / float(self.count))
-
-        self.average_bias2 = self.average_bias2 - (self.beta2 / self.count)
+    def update_average_weights_bias(self):
+        """
+        Update average weights and bias for each word
+        """
+        self.average_weights, self.average_bias = self.averaged()
 
 
     def predict(self, review):
         """
-        Predict the class of the review
+        Predict the activation of every label head for a review's token list
         """
-        prediction = 0
-        for word in review.split():
-            if word in self.average_weights1:
-                prediction += self.average_weights1[word]
-        prediction += self.average_bias1
+        prediction = self.average_bias.copy()
+        for index in self.review_ids(review):
+            prediction = prediction + self.average_weights[index]
         return prediction
 
 
     def test(self, data):
         """
-        Test the model on the test data
+        Test the model on the test data and return the accuracy of each label head
         """
-        correct = 0
+        correct = np.zeros(len(LABELS))
         for i in range(len(data.reviews)):
-            review = data.reviews[i]
-            true_fake = data.true_fake[i]
-            
-            prediction = self.predict(review)
-            if prediction > 0 and true_fake == 1:
-                correct += 1
-            elif prediction < 0 and true_fake == -1:
-                correct += 1
-        return correct / len(data.reviews)
+            prediction = self.predict(data.reviews[i])
+            correct += (prediction > 0) & (data.labels[i] == 1) | (prediction < 0) & (data.labels[i] == -1)
+        return (correct / len(data.reviews)).tolist()
             
 
 
 if __name__ == "__main__":
-    input_file = sys.argv[1]
-
-    preprocessObj = Preprocess_Data()
-    preprocessObj.read_data(input_file)
+    parser = argparse.ArgumentParser(description="train vanilla and averaged perceptrons and write vanillamodel.txt and averagedmodel.txt")
+    parser.add_argument("input_file")
+    parser.add_argument("--dev-text", help="held-out reviews to evaluate after every epoch, e.g. dev-text.txt")
+    parser.add_argument("--dev-key", help="labels for --dev-text, e.g. dev-key.txt")
+    parser.add_argument("--checkpoint-every", type=int, default=0, metavar="N", help="save the training state every N examples (0 disables)")
+    parser.add_argument("--checkpoint-dir", default=".", help="where vanillacheckpoint.npz and averagedcheckpoint.npz are written")
+    parser.add_argument("--seed", type=int, help="shuffle the reviews every epoch with this seed (default: file order)")
+    parser.add_argument("--converge", action="store_true", help="stop training after the first epoch without mistakes")
+    parser.add_argument("--holdout", type=float, default=0.0, metavar="FRACTION", help="fraction of the training reviews held out for --patience")
+    parser.add_argument("--patience", type=int, default=0, help="stop after this many epochs without a held-out improvement and keep the best epoch")
+    parser.add_argument("--hash-bits", type=int, default=0, metavar="K", help="hash words into 2^K weight rows instead of indexing the vocabulary (0 disables)")
+    parser.add_argument("--ngram", type=int, default=1, metavar="N", help="also use runs of up to N consecutive words as features")
+    parser.add_argument("--min-count", type=int, default=1, help="drop features seen fewer times than this in training")
+    parser.add_argument("--feature-index", metavar="FILE", help="write the feature index here once and keep only weight lists in the model files")
+    parser.add_argument("--state-dir", help="save the final training state as vanillastate.npz and averagedstate.npz for a later --warm-start")
+    parser.add_argument("--warm-start", metavar="DIR", help="continue from the states in DIR and train only on input_file; updated states go back to DIR unless --state-dir is given")
+    args = parser.parse_args()
+    if (args.dev_text is None) != (args.dev_key is None):
+        parser.error("--dev-text and --dev-key go together")
+    if args.patience and not args.holdout:
+        parser.error("--patience needs a --holdout fraction")
+    if args.holdout and not args.patience:
+        # the held-out reviews are only used for early stopping; without it they would just be thrown away
+        parser.error("--holdout needs --patience")
+    if args.holdout and not 0 < args.holdout < 1:
+        parser.error("--holdout must be a fraction between 0 and 1")
+    if args.hash_bits and (args.min_count > 1 or args.feature_index):
+        # the classifier hashes every feature it sees, so a hashed model cannot leave features out
+        parser.error("--hash-bits cannot be combined with --min-count or --feature-index")
+    if args.warm_start and (args.hash_bits or args.min_count > 1):
+        # pruning or hashing the grown vocabulary would move the rows the saved weights belong to
+        parser.error("--warm-start cannot be combined with --hash-bits or --min-count")
+    if args.state_dir and (args.hash_bits or args.min_count > 1):
+        # such a state could never be warm-started from, for the same reason
+        parser.error("--state-dir cannot be combined with --hash-bits or --min-count")
+    state_dir = args.state_dir or args.warm_start
+
+    preprocessObj = Preprocess_Data(args.hash_bits, args.ngram, args.min_count)
+    if args.warm_start:
+        try:
+            vanilla_state = load_state(os.path.join(args.warm_start, "vanillastate.npz"), args.hash_bits, args.min_count)
+            averaged_state = load_state(os.path.join(args.warm_start, "averagedstate.npz"), args.hash_bits, args.min_count)
+        except ValueError as e:
+            parser.error(str(e))
+        # the saved run decides the feature set; new words from input_file are appended to its vocabulary
+        preprocessObj.ngram = int(vanilla_state["ngram"])
+        preprocessObj.seed_vocabulary(vanilla_state["words"].tolist(), vanilla_state["counts"].tolist())
+    preprocessObj.read_data(args.input_file)
+    if args.feature_index:
+        preprocessObj.write_feature_index(args.feature_index)
+    dev = preprocessObj.read_dev(args.dev_text, args.dev_key) if args.dev_text else None
+    heldout = preprocessObj.hold_out(args.holdout, args.seed) if args.holdout else None
 
     # Train the vanilla perceptron model
     vanillaPerceptronObj = VanillaPerceptron(preprocessObj)
-    vanillaPerceptronObj.train(preprocessObj)
+    if args.warm_start:
+        vanillaPerceptronObj.load_state(vanilla_state)
+    vanillaPerceptronObj.stop_on_convergence = args.converge
+    vanillaPerceptronObj.patience = args.patience
+    vanillaPerceptronObj.train(preprocessObj, dev, args.checkpoint_every, os.path.join(args.checkpoint_dir, "vanillacheckpoint.npz"), args.seed, heldout, os.path.join(state_dir, "vanillastate.npz") if state_dir else None)
 
     with open('vanillamodel.txt', 'w', encoding='utf-8') as txt_file:
-            txt_file.write(json.dumps({"words":preprocessObj.words, "weights1":vanillaPerceptronObj.vanilla_weights1, "weights2":vanillaPerceptronObj.vanilla_weights2, "bias1":vanillaPerceptronObj.vanilla_bias1, "bias2":vanillaPerceptronObj.vanilla_bias2, "stopwords":list(preprocessObj.stop_words)}, ensure_ascii=False))
+            txt_file.write(json.dumps(preprocessObj.to_model(vanillaPerceptronObj.vanilla_weights, vanillaPerceptronObj.vanilla_bias, args.feature_index), ensure_ascii=False))
 
 
     # Train the averaged perceptron model
     averagePerceptronObj = AveragePerceptron(preprocessObj)
-    averagePerceptronObj.train(preprocessObj)
+    if args.warm_start:
+        averagePerceptronObj.load_state(averaged_state)
+    averagePerceptronObj.stop_on_convergence = args.converge
+    averagePerceptronObj.patience = args.patience
+    averagePerceptronObj.train(preprocessObj, dev, args.checkpoint_every, os.path.join(args.checkpoint_dir, "averagedcheckpoint.npz"), args.seed, heldout, os.path.join(state_dir, "averagedstate.npz") if state_dir else None)
 
     with open('averagedmodel.txt', 'w', encoding='utf-8') as txt_file:
-        txt_file.write(json.dumps({"words":preprocessObj.words, "weights1":averagePerceptronObj.average_weights1, "weights2":averagePerceptronObj.average_weights2, "bias1":averagePerceptronObj.average_bias1, "bias2":averagePerceptronObj.average_bias2, "stopwords":list(preprocessObj.stop_words)}, ensure_ascii=False))
\ No newline at end of file
+        txt_file.write(json.dumps(preprocessObj.to_model(averagePerceptronObj.average_weights, averagePerceptronObj.average_bias, args.feature_index), ensure_ascii=False))
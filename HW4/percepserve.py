@@ -0,0 +1,340 @@
+import numpy as np
+import argparse
+import collections
+import http.server
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+from percepclassify import PerceptronClassify
+
+# most recent request latencies kept for the p50/p99 report
+LATENCY_WINDOW = 10000
+
+
+class PendingRequest:
+    def __init__(self, model, reviews) -> None:
+        self.model = model
+        self.reviews = reviews
+        self.start = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        # set instead of result when scoring the batch failed
+        self.error = None
+
+
+class ScoringServer:
+    def __init__(self, model_files, batch_window=0.005, max_batch=256) -> None:
+        # every model is read once and kept warm for the lifetime of the server
+        self.models = {}
+        for model_file in model_files:
+            name = os.path.splitext(os.path.basename(model_file))[0]
+            self.models[name] = PerceptronClassify(model_file)
+        self.default_model = next(iter(self.models))
+
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.pending = queue.Queue()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.reviews = 0
+        self.batches = 0
+
+        self.worker = threading.Thread(target=self.batch_loop, daemon=True)
+        self.worker.start()
+
+
+    def submit(self, model, reviews):
+        """
+        Queue raw reviews for scoring and block until the batching thread has answered them
+        """
+        if model not in self.models:
+            raise KeyError(model)
+        request = PendingRequest(model, reviews)
+        self.pending.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise RuntimeError("scoring failed: " + repr(request.error))
+        return request.result
+
+
+    def collect_batch(self):
+        """
+        Take the next request plus everything else that arrives within the batching window
+        """
+        batch = [self.pending.get()]
+        size = len(batch[0].reviews)
+        deadline = time.perf_counter() + self.batch_window
+        while size < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                request = self.pending.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(request)
+            size += len(request.reviews)
+        return batch
+
+
+    def batch_loop(self):
+        while True:
+            batch = self.collect_batch()
+
+            # one vectorized block per model, however many clients contributed to it
+            by_model = {}
+            for request in batch:
+                by_model.setdefault(request.model, []).append(request)
+
+            try:
+                for name, requests in by_model.items():
+                    try:
+                        self.score_requests(self.models[name], requests)
+                    except Exception as e:
+                        # only this model's requests fail; the thread keeps serving everyone else
+                        for request in requests:
+                            request.error = e
+                    self.batches += 1
+            finally:
+                # every waiting submit() is released, whatever happened above
+                now = time.perf_counter()
+                for request in batch:
+                    self.requests += 1
+                    self.reviews += len(request.reviews)
+                    self.latencies.append(now - request.start)
+                    request.done.set()
+
+
+    def score_requests(self, classifier, requests):
+        """
+        Score the reviews of several requests as one block and hand each request its slice of the result
+        """
+        reviews = [review for request in requests for review in request.reviews]
+        scores = classifier.score(reviews).tolist()
+
+        offset = 0
+        for request in requests:
+            request.result = [{"labels": [positive if score > 0 else negative for score, (positive, negative) in zip(review_scores, classifier.labels)], "scores": review_scores} for review_scores in scores[offset:offset + len(request.reviews)]]
+            offset += len(request.reviews)
+
+
+    def stats(self):
+        latencies = np.array(self.latencies) * 1000
+        return {
+            "models": list(self.models),
+            "requests": self.requests,
+            "reviews": self.reviews,
+            "batches": self.batches,
+            "p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "p99_ms": float(np.percentile(latencies, 99)) if len(latencies) else None,
+        }
+
+
+class RequestHandler(http.server.BaseHTTPRequestHandler):
+    # set on the handler class by serve()
+    scoring_server = None
+
+    def send_json(self, status, body):
+        payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_json(200, self.scoring_server.stats())
+        else:
+            self.send_json(404, {"error": "unknown path " + self.path})
+
+
+    def do_POST(self):
+        if self.path != "/classify":
+            self.send_json(404, {"error": "unknown path " + self.path})
+            return
+
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))).decode('utf-8'))
+            reviews, model = self.parse_body(body)
+            predictions = self.scoring_server.submit(model, reviews)
+        except KeyError as e:
+            self.send_json(400, {"error": "missing or unknown " + str(e)})
+            return
+        except ValueError as e:
+            self.send_json(400, {"error": str(e)})
+            return
+        except RuntimeError as e:
+            self.send_json(500, {"error": str(e)})
+            return
+
+        self.send_json(200, {"model": model, "predictions": predictions})
+
+
+    def parse_body(self, body):
+        """
+        Validate a request body before it reaches the batching thread; malformed bodies raise ValueError
+        """
+        # either {"review": "..."} or a micro-batch {"reviews": [...]}
+        if not isinstance(body, dict):
+            raise ValueError("request body must be a JSON object")
+        reviews = [body["review"]] if "review" in body else body["reviews"]
+        if not isinstance(reviews, list) or not all(isinstance(review, str) for review in reviews):
+            raise ValueError("reviews must be a list of strings")
+        model = body.get("model", self.scoring_server.default_model)
+        if not isinstance(model, str):
+            raise ValueError("model must be a string")
+        return reviews, model
+
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(model_files, host, port, batch_window, max_batch):
+    RequestHandler.scoring_server = ScoringServer(model_files, batch_window, max_batch)
+    httpd = http.server.ThreadingHTTPServer((host, port), RequestHandler)
+    print("serving %s on http://%s:%d" % (", ".join(RequestHandler.scoring_server.models), host, port), file=sys.stderr)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+def classify_remote(url, reviews, model=None):
+    """
+    Send a micro-batch of raw reviews to a running server and return its predictions
+    """
+    body = {"reviews": reviews}
+    if model is not None:
+        body["model"] = model
+    request = urllib.request.Request(url.rstrip("/") + "/classify", data=json.dumps(body).encode('utf-8'), headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode('utf-8'))["predictions"]
+
+
+def post_raw(url, payload):
+    """
+    POST raw bytes to /classify and return the status code and decoded JSON answer, errors included
+    """
+    request = urllib.request.Request(url.rstrip("/") + "/classify", data=payload, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read().decode('utf-8'))
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read().decode('utf-8'))
+
+
+def run_check(model_files):
+    """
+    Start a server on a free local port, send it malformed requests and make sure each one is refused
+    while valid requests before and after are still answered; returns the list of failures
+    """
+    RequestHandler.scoring_server = ScoringServer(model_files)
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:%d" % httpd.server_address[1]
+
+    cases = [
+        ("valid review", b'{"review": "great hotel"}', 200),
+        ("non-string review", b'{"reviews": [123]}', 400),
+        ("reviews is a string", b'{"reviews": "some text"}', 400),
+        ("body is not an object", b'5', 400),
+        ("body is not JSON", b'{"reviews": ', 400),
+        ("missing reviews", b'{}', 400),
+        ("unknown model", b'{"review": "great hotel", "model": "nosuchmodel"}', 400),
+        ("valid batch afterwards", b'{"reviews": ["great hotel", "dirty room"]}', 200),
+    ]
+    failures = []
+    try:
+        for name, payload, expected in cases:
+            try:
+                status, answer = post_raw(url, payload)
+            except OSError as e:
+                status, answer = None, {"error": repr(e)}
+            print("%-24s %s %s" % (name, status, json.dumps(answer)[:80]), file=sys.stderr)
+            if status != expected:
+                failures.append("%s: expected %d, got %s" % (name, expected, status))
+
+        # a request that slips past validation and fails while scoring must not stall the batching thread
+        try:
+            RequestHandler.scoring_server.submit(RequestHandler.scoring_server.default_model, [123])
+            failures.append("scoring error: submit() returned instead of raising")
+        except RuntimeError:
+            pass
+        status, _ = post_raw(url, b'{"review": "great hotel"}')
+        if status != 200:
+            failures.append("after a scoring error: expected 200, got %s" % status)
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    return failures
+
+
+def run_client(url, test_file, output_file, model, batch_size, threads):
+    with open(test_file, 'r') as f:
+        rows = [line.split(" ", 1) for line in f.read().splitlines()]
+    ids = [row[0] for row in rows]
+    reviews = [row[1] if len(row) > 1 else "" for row in rows]
+
+    # several threads at once exercise the server-side coalescing of concurrent micro-batches
+    blocks = [reviews[start:start + batch_size] for start in range(0, len(reviews), batch_size)]
+    results = [None] * len(blocks)
+    def send(i):
+        results[i] = classify_remote(url, blocks[i], model)
+    for start in range(0, len(blocks), threads):
+        workers = [threading.Thread(target=send, args=(i,)) for i in range(start, min(start + threads, len(blocks)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    with open(output_file, 'w') as f:
+        for review_id, prediction in zip(ids, (prediction for result in results for prediction in result)):
+            f.write(review_id + " " + " ".join(prediction["labels"]) + "\n")
+
+    with urllib.request.urlopen(url.rstrip("/") + "/stats") as response:
+        print(response.read().decode('utf-8'))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="keep perceptron models loaded and score reviews over HTTP")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = subparsers.add_parser("serve", help="load the models once and answer POST /classify and GET /stats")
+    serve_parser.add_argument("models", nargs="+", help="model files, e.g. vanillamodel.txt averagedmodel.txt; requests pick one by file stem")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8544)
+    serve_parser.add_argument("--batch-window", type=float, default=0.005, help="seconds to wait for more requests before scoring a batch")
+    serve_parser.add_argument("--max-batch", type=int, default=256, help="reviews that close a batch early")
+
+    client_parser = subparsers.add_parser("client", help="classify a test file through a running server and write percepoutput.txt")
+    client_parser.add_argument("test_file")
+    client_parser.add_argument("--url", default="http://127.0.0.1:8544")
+    client_parser.add_argument("--model", help="model file stem, e.g. averagedmodel (default: the server's first model)")
+    client_parser.add_argument("--batch-size", type=int, default=1, help="reviews per request")
+    client_parser.add_argument("--threads", type=int, default=8, help="requests in flight at once")
+    client_parser.add_argument("--output", default="percepoutput.txt")
+
+    check_parser = subparsers.add_parser("check", help="start a local server, send it malformed requests and exit 1 unless all are refused and it keeps answering")
+    check_parser.add_argument("models", nargs="+", help="model files, e.g. averagedmodel.txt")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        serve(args.models, args.host, args.port, args.batch_window, args.max_batch)
+    elif args.command == "check":
+        failures = run_check(args.models)
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        sys.exit(1 if failures else 0)
+    else:
+        run_client(args.url, args.test_file, args.output, args.model, args.batch_size, args.threads)
@@ -0,0 +1,130 @@
+import numpy as np
+import argparse
+import copy
+import itertools
+import json
+import multiprocessing
+import sys
+import time
+
+from perceplearn import LABELS, Preprocess_Data, VanillaPerceptron, AveragePerceptron, accuracy
+
+# featurized training corpus and dev set, set once per worker process by init_worker
+worker_data = None
+worker_dev = None
+
+
+def init_worker(data, dev):
+    global worker_data, worker_dev
+    worker_data = data
+    worker_dev = dev
+
+
+def prune(data, min_count):
+    """
+    Drop words seen fewer than min_count times in training from every row; their weights stay zero
+    """
+    if min_count <= 1:
+        return data.rows
+    keep = np.array([count >= min_count for count in data.words.values()], dtype=bool)
+    rows = []
+    for features, counts in data.rows:
+        mask = keep[features]
+        rows.append((features[mask], counts[mask]))
+    return rows
+
+
+def run_config(config):
+    """
+    Train one configuration on a private copy of the shared corpus and score it on dev
+    Vanilla runs start from zero weights; averaged runs start, like perceplearn's, from the weights a default
+    vanilla run (VanillaPerceptron.epochs epochs, same seed and min_count) leaves behind
+    """
+    variant, epochs, seed, min_count = config
+
+    # shallow copy: the featurized rows and labels are shared, only the weights are fresh
+    data = copy.copy(worker_data)
+    data.rows = prune(worker_data, min_count)
+    data.weights = np.zeros((len(data.words), len(LABELS)), dtype=np.int64)
+    data.average_weights = np.zeros((len(data.words), len(LABELS)), dtype=np.int64)
+    data.bias = np.zeros(len(LABELS), dtype=np.int64)
+
+    start = time.perf_counter()
+    if variant == "vanilla":
+        perceptron = VanillaPerceptron(data)
+        perceptron.epochs = epochs
+        perceptron.train(data, seed=seed)
+        weights, bias = perceptron.vanilla_weights, perceptron.vanilla_bias
+        vanilla_epochs = 0
+    else:
+        # trains data.weights in place, which the averaged perceptron then continues from
+        vanilla = VanillaPerceptron(data)
+        vanilla.train(data, seed=seed)
+        vanilla_epochs = vanilla.epochs
+
+        perceptron = AveragePerceptron(data)
+        perceptron.epochs = epochs
+        perceptron.train(data, seed=seed)
+        weights, bias = perceptron.average_weights, perceptron.average_bias
+    train_seconds = time.perf_counter() - start
+
+    dev_accuracy = accuracy(*worker_dev, weights, bias)
+    result = {"variant": variant, "epochs": epochs, "vanilla_epochs": vanilla_epochs, "seed": seed, "min_count": min_count, "dev_accuracy": dev_accuracy, "mean_dev_accuracy": sum(dev_accuracy) / len(dev_accuracy), "train_seconds": train_seconds}
+    return result, weights, bias
+
+
+def sweep(data, dev, configs, processes=None):
+    """
+    Run every configuration in a process pool and return the results plus the weights of the best one
+    """
+    best = None
+    results = []
+    with multiprocessing.Pool(processes, initializer=init_worker, initargs=(data, dev)) as pool:
+        for result, weights, bias in pool.imap_unordered(run_config, configs):
+            results.append(result)
+            print("%-8s epochs=%-3d seed=%-4s min_count=%-2d dev=%s %.2fs" % (result["variant"], result["epochs"], result["seed"], result["min_count"], " ".join("%.4f" % a for a in result["dev_accuracy"]), result["train_seconds"]), file=sys.stderr)
+            # ties go to the cheaper run
+            if best is None or (result["mean_dev_accuracy"], -result["train_seconds"]) > (best[0]["mean_dev_accuracy"], -best[0]["train_seconds"]):
+                best = (result, weights, bias)
+
+    results.sort(key=lambda result: (-result["mean_dev_accuracy"], result["train_seconds"]))
+    return results, best
+
+
+def seed_value(text):
+    return None if text == "none" else int(text)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="train perceptrons over a grid of settings in parallel and keep the one with the best dev accuracy; averaged runs continue from a default vanilla run exactly as perceplearn.py trains them, and vanilla_epochs in the report says how long that run was")
+    parser.add_argument("input_file", help="train-labeled.txt")
+    parser.add_argument("dev_text", help="dev-text.txt")
+    parser.add_argument("dev_key", help="dev-key.txt")
+    parser.add_argument("--variants", nargs="+", default=["vanilla", "averaged"], choices=["vanilla", "averaged"])
+    parser.add_argument("--epochs", nargs="+", type=int, default=[10, 20, 40, 80], help="epochs of the vanilla run, or of the averaged run after its vanilla warm-up")
+    parser.add_argument("--seeds", nargs="+", type=seed_value, default=[None, 1, 2], help="shuffle seeds; 'none' keeps file order")
+    parser.add_argument("--min-counts", nargs="+", type=int, default=[1, 2, 3], help="drop words seen fewer times than this in training")
+    parser.add_argument("--processes", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--model", default="bestmodel.txt", help="where the best model is written")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    # tokenize and featurize once; every worker receives the same corpus when the pool starts
+    data = Preprocess_Data()
+    data.read_data(args.input_file)
+    dev = data.read_dev(args.dev_text, args.dev_key)
+
+    configs = list(itertools.product(args.variants, args.epochs, args.seeds, args.min_counts))
+    start = time.perf_counter()
+    results, (best, weights, bias) = sweep(data, dev, configs, args.processes)
+    wall_seconds = time.perf_counter() - start
+
+    with open(args.model, 'w', encoding='utf-8') as txt_file:
+        txt_file.write(json.dumps(data.to_model(weights, bias), ensure_ascii=False))
+
+    output = json.dumps({"configurations": len(configs), "wall_seconds": wall_seconds, "best": best, "model": args.model, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
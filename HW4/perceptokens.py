@@ -0,0 +1,55 @@
+import re
+import zlib
+
+# shared by perceplearn and percepclassify so both sides of the model see exactly the same tokens
+PUNCTUATION = re.compile(r'[^\w\s]')
+
+STOPWORDS = frozenset(["i", "me", "my", "myself", "we", "our", "ours", "ourselves", "you", "your", "yours", "yourself", "he", "him", "his", "himself", "she", "her", "hers", "herself", "it", "its", "itself", "they", "them", "their", "theirs", "themselves", "what", "which", "who", "whom", "this", "that", "these", "those", "am", "is", "are", "was", "were", "be", "been", "being", "have", "has", "had", "having", "do", "does", "did", "doing", "a", "an", "the", "and", "but", "if", "or", "because", "as", "until", "while", "of", "at", "by", "for", "with", "about", "against", "between", "into", "through", "during", "before", "after", "above", "below", "to", "from", "up", "down", "in", "out", "on", "off", "over", "under", "again", "further", "then", "once", "here", "there", "when", "where", "so", "than", "too", "very", "can", "will", "just", "should", "now"])
+
+
+def tokens(text, stopwords=STOPWORDS):
+    """
+    Lowercase the review, strip punctuation and yield the words that are not stopwords
+    """
+    # punctuation is removed before the stopword check, so "it's" becomes the stopword "its"
+    for word in PUNCTUATION.sub('', text.lower()).split():
+        if word not in stopwords:
+            yield word
+
+
+def ngrams(words, ngram=1):
+    """
+    Yield every word followed by the runs of up to ngram words that end with it, joined by spaces
+    """
+    recent = []
+    for word in words:
+        recent.append(word)
+        if len(recent) > ngram:
+            del recent[0]
+        for start in range(len(recent) - 1, -1, -1):
+            yield " ".join(recent[start:])
+
+
+def token_ids(text, word_index, stopwords=STOPWORDS, ngram=1):
+    """
+    Yield the feature index of every known token (and n-gram) of the review, in order
+    """
+    for feature in ngrams(tokens(text, stopwords), ngram):
+        if feature in word_index:
+            yield word_index[feature]
+
+
+def feature_hash(word, hash_bits):
+    """
+    Bucket of a word in a 2^hash_bits weight array
+    """
+    # crc32 gives the learner and the classifier the same bucket; the built-in hash() is salted per process
+    return zlib.crc32(word.encode('utf-8')) & ((1 << hash_bits) - 1)
+
+
+def hashed_ids(text, hash_bits, stopwords=STOPWORDS, ngram=1):
+    """
+    Yield the hash bucket of every token (and n-gram) of the review, in order
+    """
+    for feature in ngrams(tokens(text, stopwords), ngram):
+        yield feature_hash(feature, hash_bits)